@@ -9,10 +9,29 @@ from interface import (
     ConsoleUserInput,
     ABCRecord,
 )
+from autosave import AutoSaver
+from completion import Completer, set_completer
+from command_log import CommandLog
+from contextlib import nullcontext
+from indexes import DeletionIndex, InvertedIndex, SortedIndex
+from contact_query import QueryError, parse_query, plan_query
+from contact_stats import ContactColumns
+from contact_dedupe import find_duplicates, merge_items
+from birthdays import days_to_birthday
+from address_shards import SHARD_FOLDER, ShardedStorage
+from load_cache import load_cache, save_cache
+from contact_validation import (
+    is_valid_email,
+    is_valid_phone,
+    normalize_phone,
+    parse_birthday,
+    validate_items,
+)
 from collections import UserDict
-from datetime import datetime, timedelta
-import json, re
+from datetime import date, datetime
+import json, os
 import logging
+import threading
 
 logger = logging.getLogger("Address Debugger")
 logger.setLevel(logging.DEBUG)
@@ -30,6 +49,12 @@ fh.setFormatter(formatter)
 logger.addHandler(ch)
 logger.addHandler(fh)
 
+# records of save.json that failed validation on load, and how many of them are listed in the console
+INVALID_RECORDS_FILE = "save_invalid.json"
+INVALID_REPORT_LIMIT = 20
+# 0 - the whole book is one save.json; N - it is split into N files in save_shards/, for very big books
+SAVE_SHARDS = 0
+
 """Class Field виступає головним класом від якого наслідуються інші класи, такі як: Birthday, Name, Phone, Email, 
 Address. Використовується для приведення типів данних."""
 
@@ -57,20 +82,9 @@ class Birthday(Field):
     def __init__(self, value: str) -> None:
         self.__value = value  # from 10 January 2020
 
-    def _days_to_birthday(self) -> int:
-        datenow = datetime.now().date()
-        future_bday_date = datetime(
-            year=datenow.year, month=self.value.month, day=self.value.day
-        ).date()
-
-        if future_bday_date < datenow:
-            future_bday_date = datetime(
-                year=datenow.year + 1, month=self.value.month, day=self.value.day
-            ).date()
-
-        delta = future_bday_date - datenow
-        pure_days = delta.days % 365
-        return pure_days
+    # today is passed by callers that go over many records, so the date is taken once for all of them
+    def _days_to_birthday(self, today: date = None) -> int:
+        return days_to_birthday(self.value.month, self.value.day, today)
 
     @property
     def value(self) -> str:
@@ -79,7 +93,7 @@ class Birthday(Field):
     @value.setter
     def value(self, new_value: str) -> str:
         try:
-            self.__value = datetime.strptime(new_value, "%d %B %Y").date()
+            self.__value = parse_birthday(new_value)
         except ValueError:
             logger.debug(
                 'Your data format is not correct! Please use this one: "10 January 2020"'
@@ -118,26 +132,13 @@ class Phone(Field):
 
     @staticmethod
     def valid_phone(phone: str) -> bool:
-        if 10 <= len(phone) <= 13:
-            if phone.replace("+", "").isdigit():
-                return True
-
-            return False
-
-        else:
-            return False
+        return is_valid_phone(phone)
 
     @staticmethod
     def convert_phone_number(phone: str) -> str:
-        correct_phone_number = ""
-
-        if phone.startswith("+380") and len(phone) == 13:
-            correct_phone_number = phone
-        elif phone.startswith("80") and len(phone) == 11:
-            correct_phone_number = "+3" + phone
-        elif phone.startswith("0") and len(phone) == 10:
-            correct_phone_number = "+38" + phone
-        else:
+        correct_phone_number = normalize_phone(phone)
+
+        if correct_phone_number is None:
             logger.debug(
                 "Number format is not correct! Must contain 10-13 symbols and must match the one of the current "
                 "formats: +380001112233 or 80001112233 or 0001112233!"
@@ -176,11 +177,7 @@ class Email(Field):
 
     @staticmethod
     def valid_email(email: str) -> bool:
-        if re.match(
-            r"^[\w.+\-]{1}[\w.+\-]+@\w+\.[a-z]{2,3}\.[a-z]{2,3}$", email
-        ) or re.match(r"^[\w.+\-]{1}[\w.+\-]+@\w+\.[a-z]{2,3}$", email):
-            return True
-        return False
+        return is_valid_email(email)
 
     @value.setter
     def value(self, new_value: str) -> None:
@@ -294,7 +291,7 @@ class Record(ABCRecord):
 
         days_left = self.birthday._days_to_birthday()
         logger.debug(
-            f'{self.name.value}\'s birthday will be roughly in {days_left} days! ({self.birthday.value.strftime("%d %B %Y")})'
+            f'{self.name.value}\'s birthday will be in {days_left} days! ({self.birthday.value.strftime("%d %B %Y")})'
         )
 
     def set_birthday(self, date_val: str) -> None:
@@ -306,98 +303,276 @@ class Record(ABCRecord):
         self.email.value = email_val
         logger.debug(f"{self.email} email record was added for {self.name.value}!")
 
+    # the same dict shape as one item of save.json
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name.value,
+            "Phone number": [str(ph) for ph in self.phones],
+            "Date of birth": (
+                self.birthday.value.strftime("%d %B %Y") if self.birthday else ""
+            ),
+            "email": str(self.email) if self.email else "",
+            "address": str(self.address) if self.address else "",
+        }
+
+    # builds a record from already validated data (save.json item or undo snapshot) without logging
+    @classmethod
+    def from_dict(cls, item: dict) -> "Record":
+        record = cls(
+            Name(item["name"]),
+            Phone(item["Phone number"][0]),
+            Email(item["email"]),
+            Address(item["address"]),
+        )
+        record.phones = [Phone(ph) for ph in item["Phone number"]]
+
+        if item["Date of birth"]:
+            record.birthday = Birthday("")
+            record.birthday.value = item["Date of birth"]
+
+        return record
+
 
 # Lower Entity Classes
 class AddressBook(UserDict):
-    def __init__(self) -> None:
+    def __init__(self, shards: int = 0) -> None:
         super().__init__()
         self.is_finished = False
+        # held by the input loop while a command runs and by the autosave worker while it copies the records
+        self.lock = threading.RLock()
+        # held while save.json is written, the autosave writes its copy without the book lock
+        self.save_lock = threading.Lock()
+        # casefolded names for 'find ~<name>', kept in sync by add_record/delete_record
+        self.name_index = DeletionIndex()
+        # (casefolded name, name) in alphabetical order for 'show all', 'show some' and 'show from'
+        self.sorted_names = SortedIndex()
+        # phone -> names for 'query phone:...'; name -> phones it is indexed under
+        self.phone_index = InvertedIndex()
+        self.indexed_phones = {}
+        # column snapshot for 'stats' and 'bday in', built again after any change
+        self._columns = None
+        # undo/redo of the commands that changed the book
+        self.command_log = CommandLog(self)
+        # phones are changed on the records directly, so the phone index follows every logged change
+        self.command_log.listeners.append(self.reindex)
+        # split storage instead of save.json, None - one file
+        self.shards = ShardedStorage(SHARD_FOLDER, shards) if shards else None
+        if self.shards is not None:
+            self.command_log.listeners.append(self.shards.mark_dirty)
         self._load()
 
     def add_record(self, record: Record, *_) -> None:
-        self.data.update({record.name.value: record})
+        name = record.name.value
+        if name not in self.data:
+            self.name_index.add(name.casefold(), name)
+            self.sorted_names.add(name.casefold(), name)
+        self.data.update({name: record})
+        self.reindex([name])
 
     def delete_record(self, contact_name: Name) -> None:
         if str(contact_name) in self.data:
             del self.data[str(contact_name)]
+            self.name_index.remove(str(contact_name).casefold(), str(contact_name))
+            self.sorted_names.remove(str(contact_name).casefold(), str(contact_name))
+            self.reindex([str(contact_name)])
             return None
 
-    def _save(self) -> None:
-        file_data = []
-
-        for record in self.data.values():
-            write_dict = {}
-            write_dict["name"] = record.name.value
-            write_dict["Phone number"] = [str(ph) for ph in record.phones]
-            write_dict["Date of birth"] = (
-                record.birthday.value.strftime("%d %B %Y") if record.birthday else ""
-            )
-            write_dict["email"] = str(record.email) if record.email else ""
-            write_dict["address"] = str(record.address) if record.address else ""
-            file_data.append(write_dict)
+    def reindex(self, names: list) -> None:
+        self._columns = None
 
-        with open("save.json", "w") as writer:
-            json.dump(file_data, writer, indent=4)
+        for name in names:
+            record = self.data.get(name)
+            phones = {str(ph) for ph in record.phones} if record else set()
+            old_phones = self.indexed_phones.pop(name, set())
 
-    def iterator(self, n: int) -> None:
-        counter = 0
+            for phone in old_phones - phones:
+                self.phone_index.remove(phone, name)
+            for phone in phones - old_phones:
+                self.phone_index.add(phone, name)
+            if phones:
+                self.indexed_phones[name] = phones
 
-        if n > len(self.data):
-            n = len(self.data)
-            logger.debug(
-                f"Seems like there is only {len(self.data)} items in the book!"
-            )
-            counter = len(self.data) + 1
+    # puts the records named after the first one into it and deletes them
+    def merge(self, names: list) -> None:
+        merged = merge_items([self.data[name].to_dict() for name in names])
 
-        for key, value in self.data.items():
-            recorded_phones = ""
-            recorded_phones = ", ".join([str(ph) for ph in value.phones])
-            logger.debug(
-                f"{key}| Phones: {recorded_phones} | BDay: {value.birthday} | Email: {value.email} | Address: {value.address}"
-            )
-            counter += 1
+        for name in names[1:]:
+            self.delete_record(Name(name))
+        self.restore(names[0], merged)
 
-            if counter == n:
-                counter = 0
-                logger.debug("*" * 10)
-                yield
+    def columns(self) -> ContactColumns:
+        if self._columns is None:
+            self._columns = ContactColumns.from_book(self)
+        return self._columns
 
-        logger.debug("This was the end of the address book!")
-        return
+    # names within a few typos from the query, closest first
+    def find_similar(self, name: str, tolerance: int = None) -> list:
+        if tolerance is None:
+            tolerance = 1 if len(name) <= 3 else 2
+
+        return self.name_index.search(name.casefold(), tolerance)
+
+    # state of one record for the undo log, None if there is no such record
+    def snapshot(self, name: str) -> dict:
+        record = self.data.get(name)
+        return record.to_dict() if record else None
+
+    def restore(self, name: str, state: dict) -> None:
+        self.delete_record(Name(name))
+
+        if state is not None:
+            self.add_record(Record.from_dict(state))
+
+    # the save on close: everything under the lock, together with the load cache
+    def _save(self) -> None:
+        with self.lock, self.save_lock:
+            if self.shards is not None:
+                self.shards.write(self.shards.collect(self.data))
+                return
+
+            file_data = [record.to_dict() for record in self.data.values()]
+            self._write_file(file_data)
+            save_cache("save.json", self._cached_state(file_data, []))
+
+    # the background save: the lock only for copying the records, commands do not wait for the disk;
+    # the load cache is left for the save on close, it is only rebuilt once if the session ends without it
+    def _autosave(self) -> None:
+        with self.lock:
+            if self.shards is not None:
+                file_data = self.shards.collect(self.data)
+            else:
+                file_data = [record.to_dict() for record in self.data.values()]
+            # taken before the book lock is released, so a later save can not be overtaken by this one
+            self.save_lock.acquire()
 
-    def _load(self) -> None:
         try:
-            with open("save.json") as reader:
-                try:
-                    file_data = json.load(reader)
+            if self.shards is not None:
+                self.shards.write(file_data)
+            else:
+                self._write_file(file_data)
+        finally:
+            self.save_lock.release()
 
-                    for item in file_data:
-                        name = Name(item["name"])
-                        row_phones = item["Phone number"]
-                        row_email = Email(item["email"])
-                        row_address = Address(item["address"])
-                        record = Record(
-                            name, Phone(row_phones[0]), row_email, row_address
-                        )
+    def _write_file(self, file_data: list) -> None:
+        # write to a temporary file first, so an interrupted background save never leaves a broken save.json
+        with open("save.json.tmp", "w") as writer:
+            json.dump(file_data, writer, indent=4)
+        os.replace("save.json.tmp", "save.json")
+
+    # One page of records in name order, starting from the first name >= start (case-insensitive)
+    # or right after the cursor of the previous page; the cursor for the next page is None on the last one
+    def page(self, size: int, start: str = "", cursor: tuple = None, prefix: str = "") -> tuple:
+        pairs, next_cursor = self.sorted_names.page(size, start.casefold(), cursor, prefix.casefold())
+        return [self.data[name] for _, name in pairs], next_cursor
+
+    def records_in_order(self):
+        for _, name in self.sorted_names.pairs_from():
+            yield self.data[name]
+
+    # Adds many records (save.json items) at once. They are validated first, in parallel for big lists;
+    # the invalid ones are not added but returned as [(position, item, errors)].
+    def add_items(self, items: list) -> list:
+        valid_items, invalid_items = validate_items(items)
+
+        for item in valid_items:
+            self.add_record(Record.from_dict(item))
+
+        return invalid_items
+
+    # everything _load builds from save.json, for the sidecar cache. The records go there as save.json items
+    # and are built again on load: a pickled Record would bring the module it was defined in (address_book,
+    # or __main__ when the book runs as a script) along, and the indexes hold nothing but strings
+    def _cached_state(self, items: list, invalid_items: list) -> dict:
+        return {
+            "items": items,
+            "name_index": self.name_index,
+            "sorted_names": self.sorted_names,
+            "phone_index": self.phone_index,
+            "indexed_phones": self.indexed_phones,
+            "invalid_items": invalid_items,
+        }
 
-                        iter = 1
-                        while iter < len(row_phones):
-                            record.add_phone(row_phones[iter])
-                            iter += 1
+    # a cache that can not be built from leaves the book untouched, it is then loaded from save.json
+    def _from_cached_state(self, state: dict) -> dict:
+        data = {item["name"]: Record.from_dict(item) for item in state["items"]}
+        self.name_index, self.sorted_names, self.phone_index, self.indexed_phones = (
+            state["name_index"],
+            state["sorted_names"],
+            state["phone_index"],
+            state["indexed_phones"],
+        )
+        self.data = data
+        return state
 
-                        if item["Date of birth"] == "":
-                            record.birthday = ""
-                        else:
-                            record.set_birthday(item["Date of birth"])
+    def _load(self) -> None:
+        if self.shards is not None:
+            if self.shards.has_files():
+                invalid_items = self.add_items(self.shards.load())
+                if invalid_items:
+                    self._report_invalid(invalid_items)
+                return
 
-                        self.data[item["name"]] = record
+            # the first launch with shards: the records come from save.json, all shards are written with the next save
+            self.shards.mark_all_dirty()
+
+        state = load_cache("save.json", self._from_cached_state)
+        if state is not None:
+            if state["invalid_items"]:
+                self._report_invalid(state["invalid_items"])
+            return
 
+        try:
+            with open("save.json") as reader:
+                try:
+                    file_data = json.load(reader)
                 except json.decoder.JSONDecodeError:
                     file_data = []
 
         except FileNotFoundError:
             with open("save.json", "w"):
                 ...
+            return
+
+        valid_items, invalid_items = validate_items(file_data)
+        for item in valid_items:
+            self.add_record(Record.from_dict(item))
+        save_cache("save.json", self._cached_state(valid_items, invalid_items))
+        if invalid_items:
+            self._report_invalid(invalid_items)
+
+    # all the invalid records are reported at once and kept in a separate file, so the next save does not lose them;
+    # the file is only added to: the records put aside by earlier loads are already gone from save.json
+    def _report_invalid(self, invalid_items: list) -> None:
+        try:
+            with open(INVALID_RECORDS_FILE) as reader:
+                kept = json.load(reader)
+        except FileNotFoundError:
+            kept = []
+        except json.decoder.JSONDecodeError:
+            # never write over a file that can not be read, the records in it may exist nowhere else
+            logger.debug(f"{INVALID_RECORDS_FILE} can not be read, the invalid records are not added to it")
+            kept = None
+
+        if kept is not None:
+            # the same record comes again from every load until save.json is saved without it
+            known = {json.dumps(entry.get("record"), sort_keys=True) for entry in kept if isinstance(entry, dict)}
+            for position, item, errors in invalid_items:
+                key = json.dumps(item, sort_keys=True)
+                if key not in known:
+                    known.add(key)
+                    kept.append({"position": position, "errors": errors, "record": item})
+
+            with open(INVALID_RECORDS_FILE + ".tmp", "w") as writer:
+                json.dump(kept, writer, indent=4)
+            os.replace(INVALID_RECORDS_FILE + ".tmp", INVALID_RECORDS_FILE)
+
+        kept_in = f", they are kept in {INVALID_RECORDS_FILE}" if kept is not None else ""
+        logger.debug(f"{len(invalid_items)} saved record(s) are not valid and were not loaded{kept_in}:")
+        for position, item, errors in invalid_items[:INVALID_REPORT_LIMIT]:
+            name = item.get("name") if isinstance(item, dict) else None
+            logger.debug(f"#{position} {name}: {', '.join(errors)}")
+        if len(invalid_items) > INVALID_REPORT_LIMIT:
+            logger.debug(f"... and {len(invalid_items) - INVALID_REPORT_LIMIT} more")
 
 
 # Interface Classes
@@ -425,6 +600,10 @@ class AddressBookConsoleUI(ConsoleUI):
             "edit phone": manager_interface._edit_phone,
             "show all": output_interface._show_all_items,
             "show some": output_interface._show_some_items,
+            "show from": output_interface._show_from,
+            "query": output_interface._query,
+            "stats": output_interface._show_stats,
+            "dedupe": manager_interface._dedupe,
             "delete phone": manager_interface._delete_phone,
             "delete contact": manager_interface._delete_record,
             "set bday": manager_interface._set_birthday,
@@ -436,6 +615,28 @@ class AddressBookConsoleUI(ConsoleUI):
             "find": output_interface._find,
             "help": self.display_menu,
             "bday in": output_interface._show_bday_in_days,
+            "undo": manager_interface._undo,
+            "redo": manager_interface._redo,
+        }
+
+        # commands that change the record named in their first argument, they go to the undo log
+        self.mutating_commands = {
+            "add",
+            "add phone",
+            "edit phone",
+            "delete phone",
+            "delete contact",
+            "set bday",
+            "set email",
+            "set address",
+        }
+
+        # commands that take a contact name first, Tab completes the name after them
+        self.name_commands = self.mutating_commands - {"add"} | {
+            "show bday",
+            "show email",
+            "show address",
+            "show from",
         }
 
     # Universal command performer/handler
@@ -464,6 +665,11 @@ class AdressBookInformationOutput(InformationOutputManager):
 
         str_to_find = line_list[1]
         is_empty = True
+
+        if str_to_find.startswith("~") and len(str_to_find) > 1:
+            self._find_similar(adr_book, str_to_find[1:])
+            return
+
         logger.debug(f"Looking for {str_to_find}. Found...")
 
         for record in adr_book.data.values():
@@ -501,6 +707,65 @@ class AdressBookInformationOutput(InformationOutputManager):
         if is_empty:
             logger.debug("Nothing!")
 
+    @exception_catcher_decorator
+    def _show_stats(self, adr_book: AddressBook, *_) -> None:
+        columns = adr_book.columns()
+        logger.debug(f"Records: {len(columns)}")
+
+        for field, count in columns.missing().items():
+            logger.debug(f"Without {field}: {count}")
+
+        logger.debug("Birthdays per month:")
+        for month, count in enumerate(columns.birthdays_per_month(), start=1):
+            logger.debug(f"{datetime(2000, month, 1).strftime('%B')}: {count}")
+
+        logger.debug("Contacts per operator code:")
+        for code, count in columns.contacts_per_code():
+            logger.debug(f"0{code:02}: {count}")
+
+    @exception_catcher_decorator
+    def _query(self, adr_book: AddressBook, line_list: list, *_) -> None:
+        words = line_list[1:]
+        is_explain = bool(words) and words[0].casefold() == "explain"
+        if is_explain:
+            words = words[1:]
+
+        try:
+            plan = plan_query(adr_book, parse_query(" ".join(words)))
+        except QueryError as error:
+            logger.debug(error)
+            raise WrongArgumentFormat
+
+        if is_explain:
+            logger.debug(f"Plan for: {' '.join(words)}")
+            for line in plan.explain():
+                logger.debug(line)
+            return
+
+        records = plan.run(adr_book)
+        for record in records:
+            phones_string = ", ".join([str(ph) for ph in record.phones])
+            logger.debug(
+                f"Name: {record.name} | Phones: {phones_string} | Birthday: {record.birthday} | Email: {record.email} | Address: {record.address}"
+            )
+
+        if not records:
+            logger.debug("Nothing!")
+
+    def _find_similar(self, adr_book: AddressBook, name: str) -> None:
+        logger.debug(f"Looking for names similar to {name}. Found...")
+        matches = adr_book.find_similar(name)
+
+        for distance, record_name in matches:
+            record = adr_book.data[record_name]
+            phones_string = ", ".join([str(ph) for ph in record.phones])
+            logger.debug(
+                f"({distance} typo(s)) Name: {record.name} | Phones: {phones_string} | Birthday: {record.birthday} | Email: {record.email} | Address: {record.address}"
+            )
+
+        if not matches:
+            logger.debug("Nothing!")
+
     @exception_catcher_decorator
     def _hello(self, *_) -> None:
         logger.debug("How can I help you?")
@@ -511,41 +776,59 @@ class AdressBookInformationOutput(InformationOutputManager):
             logger.debug("Your list is empty!")
             return
 
-        for record in adr_book.data:
-            if bool(adr_book.data[record].phones) == False:
+        for value in adr_book.records_in_order():
+            record = value.name.value
+            if bool(value.phones) == False:
                 logger.debug(f"Your list for {record} is empty!")
                 continue
 
             logger.debug(
-                f'Phones for {record} (email = "{adr_book.data[record].email.value}", address = "{adr_book.data[record].address.value}", BDay = "{adr_book.data[record].birthday}"):'
+                f'Phones for {record} (email = "{value.email.value}", address = "{value.address.value}", BDay = "{value.birthday}"):'
             )
-            for id, phone in enumerate(adr_book.data[record].phones, 1):
+            for id, phone in enumerate(value.phones, 1):
                 logger.debug(f"{id}) - {phone}")
 
     @exception_catcher_decorator
     def _show_some_items(self, adr_book, *_) -> None:
-        n = input("How much records to show at a time? ")
-        logger.debug("*" * 10)
-        iterator = adr_book.iterator(int(n))
+        self._show_pages(adr_book)
 
-        try:
-            next(iterator)
-        except StopIteration:
-            return
+    @exception_catcher_decorator
+    def _show_from(self, adr_book, line_list: list, *_) -> None:
+        self._show_pages(adr_book, " ".join(line_list[1:]))
+
+    # pages of the records in name order from the start name; every page is fetched only when asked for
+    def _show_pages(self, adr_book: AddressBook, start: str = "") -> None:
+        n = int(input("How much records to show at a time? "))
+        if n <= 0:
+            logger.debug("The number of records should be positive!")
+            raise WrongArgumentFormat
+
+        cursor = None
+        logger.debug("*" * 10)
 
         while True:
-            action = input("Show next part? (Y/N): ").casefold()
+            records, cursor = adr_book.page(n, start, cursor)
+            for value in records:
+                recorded_phones = ", ".join([str(ph) for ph in value.phones])
+                logger.debug(
+                    f"{value.name}| Phones: {recorded_phones} | BDay: {value.birthday} | Email: {value.email} | Address: {value.address}"
+                )
 
-            if action == "y":
-                try:
+            if cursor is None:
+                logger.debug("This was the end of the address book!")
+                return
+
+            logger.debug("*" * 10)
+            while True:
+                action = input("Show next part? (Y/N): ").casefold()
+
+                if action == "y":
                     logger.debug("*" * 10)
-                    next(iterator)
-                except StopIteration:
+                    break
+                elif action == "n":
                     return
-            elif action == "n":
-                return
-            else:
-                logger.debug("I do not understand the command!")
+                else:
+                    logger.debug("I do not understand the command!")
 
     @exception_catcher_decorator
     def _show_email(self, adr_book: AddressBook, line_list: list, *_) -> None:
@@ -588,29 +871,25 @@ class AdressBookInformationOutput(InformationOutputManager):
             logger.debug("Timeframe could not be a negative number!")
             raise WrongArgumentFormat
 
-        datetime_timedelta = timedelta(days=int(days_timeframe))
+        columns = adr_book.columns()
         is_empty = True
 
         logger.debug(f"You wanted to see Bdays in {days_timeframe} days! Here we go: ")
 
-        for record in adr_book.data.values():
-            if type(record.birthday) == str:
-                continue
-
-            record_timedelta = timedelta(days=record.birthday._days_to_birthday())
-
-            if record_timedelta <= datetime_timedelta:
-                recorded_phones = ", ".join([str(ph) for ph in record.phones])
+        # the nearest first, computed over the birthday columns at once
+        for row, days_left in columns.birthdays_within(days_timeframe):
+            record = adr_book.data[columns.names[row]]
+            recorded_phones = ", ".join([str(ph) for ph in record.phones])
 
-                logger.debug("=" * 10)
-                logger.debug(
-                    f"{record.name} will have a BDay in {record_timedelta.days}! ({record.birthday})"
-                )
-                logger.debug(
-                    f"His data: phones - {recorded_phones}, email - {record.email}, address - {record.address}"
-                )
+            logger.debug("=" * 10)
+            logger.debug(
+                f"{record.name} will have a BDay in {days_left}! ({record.birthday})"
+            )
+            logger.debug(
+                f"His data: phones - {recorded_phones}, email - {record.email}, address - {record.address}"
+            )
 
-                is_empty = False
+            is_empty = False
 
         if is_empty:
             logger.debug("Sorry! Seems like nobody have BDays in the set timeframe!")
@@ -624,6 +903,12 @@ class AddressBookManager(Manager):
             logger.debug("Not enough arguments for add_record!")
             return
 
+        if line_list[1] in adr_book.data:
+            logger.debug(
+                f"Record for {line_list[1]} already exists! Use 'add phone' or 'set ...' to change it."
+            )
+            return
+
         name = Name(line_list[1])
         phone_number = Phone("")
         phone_number.value = line_list[2]
@@ -708,9 +993,56 @@ class AddressBookManager(Manager):
         else:
             logger.debug("No such phone record!")
 
+    @exception_catcher_decorator
+    def _dedupe(self, adr_book: AddressBook, *_) -> None:
+        groups = find_duplicates(adr_book)
+        if not groups:
+            logger.debug("No duplicates found!")
+            return
+
+        logger.debug(f"Found {len(groups)} group(s) of possible duplicates.")
+
+        for number, (names, reasons) in enumerate(groups, 1):
+            logger.debug("*" * 10)
+            logger.debug(f"{number}) {', '.join(reasons)}:")
+            for name in names:
+                logger.debug(f"    {adr_book.data[name]}")
+
+            while True:
+                action = input(f"Merge them into {names[0]}? (Y/N/stop): ").casefold()
+
+                if action == "y":
+                    # one operation for all the records, a single 'undo' brings them all back
+                    with adr_book.command_log.track(f"merge {' '.join(names)}", names):
+                        adr_book.merge(names)
+                    logger.debug(f"Merged into {names[0]}!")
+                    break
+                elif action == "n":
+                    break
+                elif action == "stop":
+                    return
+                else:
+                    logger.debug("I do not understand the command!")
+
+    def _undo(self, adr_book: AddressBook, *_) -> None:
+        operation = adr_book.command_log.undo()
+
+        if operation:
+            logger.debug(f"Undone: {operation.description}")
+        else:
+            logger.debug("Nothing to undo!")
+
+    def _redo(self, adr_book: AddressBook, *_) -> None:
+        operation = adr_book.command_log.redo()
+
+        if operation:
+            logger.debug(f"Redone: {operation.description}")
+        else:
+            logger.debug("Nothing to redo!")
+
     def _close_without_saving(self, adr_book, *_):
         adr_book.is_finished = True
-        logger.debug("Will NOT save! BB!")
+        logger.debug("Will NOT save the changes since the last autosave! BB!")
 
     def _finish_session(self, adr_book, *_) -> bool:
         adr_book._save()
@@ -764,7 +1096,7 @@ class AddressBookMenu(Menu):
     def __init__(self) -> None:
         # command vocab with descriptions
         self.command_description = {
-            "not save": "Close adress book without saving",
+            "not save": "Close adress book without saving the changes since the last autosave",
             "good bye": "Save changes and close address book",
             "close": "Save changes and close address book",
             "hello": "Hear some greeting from me",
@@ -773,6 +1105,7 @@ class AddressBookMenu(Menu):
             "edit phone": "Edit a phone of the existing record",
             "show all": "Show all the records",
             "show some": "Show some number of the records at a time",
+            "show from": "Show the records in name order starting from the name (or its first letters)",
             "delete phone": "Delete the phone of the existing record",
             "delete contact": "Delete record completely",
             "set bday": "Set a BDay for the existing record",
@@ -781,9 +1114,14 @@ class AddressBookMenu(Menu):
             "show bday": "Show a BDay for the existing record",
             "show email": "Show an email for the existing record",
             "show address": "Show an address for the existing record",
-            "find": "Find record that contains ...",
+            "find": "Find record that contains ... ('find ~name' tolerates typos in the name)",
+            "query": "Find records by several conditions at once, e.g. 'query name:an* phone:+38063* bday<30 has:email' ('query explain ...' shows how it will be searched)",
+            "stats": "Show how many records miss an email, address, BDay or phone, BDays per month and contacts per operator code",
+            "dedupe": "Find records that are probably the same person (same phone or email, similar names) and merge them",
             "help": "Show full list of available commands",
             "bday in": "Show records that have BDay in set timeframe of days",
+            "undo": "Undo the last change",
+            "redo": "Redo the last undone change",
         }
 
     def show_menu(self, *_) -> None:
@@ -802,7 +1140,13 @@ def main() -> None:
         output_interface, manager_interface, menu_interface, input_interface
     )
 
-    adr_book = AddressBook()
+    adr_book = AddressBook(SAVE_SHARDS)
+    autosaver = AutoSaver(adr_book._autosave)
+    autosaver.start()
+    adr_book.command_log.listeners.append(lambda names: autosaver.notify())
+    previous_completer = set_completer(
+        Completer(ui.command_list, adr_book.sorted_names, ui.name_commands)
+    )
 
     logger.debug("*" * 10)
     ui.output_interface._hello()
@@ -814,10 +1158,20 @@ def main() -> None:
         user_input = ui.get_user_input()
         line_list = parse_command(user_input, ui.command_list)
         current_command = line_list[0].casefold()
-        ui.perform_command(current_command, adr_book, line_list)
+
+        with adr_book.lock:
+            if current_command in ui.mutating_commands:
+                tracker = adr_book.command_log.track(user_input, line_list[1:2])
+            else:
+                tracker = nullcontext()
+
+            with tracker:
+                ui.perform_command(current_command, adr_book, line_list)
 
         # checker to return to jason.py, bcz decorator over 'perform_command' returns None and makes it tricky
         if adr_book.is_finished:
+            autosaver.stop()
+            set_completer(previous_completer)
             break
 
 
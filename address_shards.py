@@ -0,0 +1,106 @@
+# Address book kept in several files instead of one save.json. A record lives in shard crc32(name) % count,
+# a save rewrites only the shards with changed records, and the shard files are read and written several at once.
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import re
+import zlib
+
+SHARD_FOLDER = "save_shards"
+# shard files read or written at the same time
+SHARD_WORKERS = 8
+SHARD_PATTERN = re.compile(r"^shard_\d+_of_\d+\.json$")
+
+
+class ShardedStorage:
+    def __init__(self, folder: str, count: int, workers: int = SHARD_WORKERS) -> None:
+        self.folder = folder
+        self.count = count
+        self.workers = workers
+        # shards with changes that are not on the disk yet
+        self.dirty = set()
+        # files of another shard count, deleted once their records are written to the current shards
+        self.stale_files = []
+
+    # crc32, not hash(): the shard of a name must be the same in every launch
+    def shard_of(self, name: str) -> int:
+        return zlib.crc32(name.encode("utf-8")) % self.count
+
+    def path(self, shard: int) -> str:
+        return os.path.join(self.folder, f"shard_{shard:03d}_of_{self.count:03d}.json")
+
+    def files(self) -> list:
+        try:
+            return sorted(file for file in os.listdir(self.folder) if SHARD_PATTERN.match(file))
+        except FileNotFoundError:
+            return []
+
+    def has_files(self) -> bool:
+        return bool(self.files())
+
+    # command_log listener: the shards of the changed names are written with the next save
+    def mark_dirty(self, names: list) -> None:
+        self.dirty.update(self.shard_of(name) for name in names)
+
+    def mark_all_dirty(self) -> None:
+        self.dirty = set(range(self.count))
+
+    # save.json items of all shards; shards of another count are read too and rewritten with the next save
+    def load(self) -> list:
+        files = self.files()
+        own_files = {os.path.basename(self.path(shard)) for shard in range(self.count)}
+        self.stale_files = [file for file in files if file not in own_files]
+        if self.stale_files:
+            self.mark_all_dirty()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            parts = list(executor.map(self._read, files))
+        return [item for part in parts for item in part]
+
+    def _read(self, file: str) -> list:
+        with open(os.path.join(self.folder, file)) as reader:
+            try:
+                return json.load(reader)
+            except json.decoder.JSONDecodeError:
+                return []
+
+    # shard -> save.json items of the dirty shards of data (name -> Record), taken under the book lock;
+    # the shards count as clean from here, write() marks the ones it could not write as dirty again
+    def collect(self, data: dict) -> dict:
+        shards = {shard: [] for shard in self.dirty}
+        self.dirty = set()
+
+        if shards:
+            for name, record in data.items():
+                items = shards.get(self.shard_of(name))
+                if items is not None:
+                    items.append(record.to_dict())
+        return shards
+
+    def write(self, shards: dict) -> None:
+        if not shards:
+            return
+
+        os.makedirs(self.folder, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(shards))) as executor:
+            failed = [shard for shard, is_written in zip(shards, executor.map(self._write, shards.items())) if not is_written]
+        if failed:
+            self.dirty.update(failed)
+            raise OSError(f"Could not write {len(failed)} shard(s) of the address book to {self.folder}")
+
+        for file in self.stale_files:
+            os.remove(os.path.join(self.folder, file))
+        self.stale_files = []
+
+    def _write(self, shard_items: tuple) -> bool:
+        shard, items = shard_items
+        path = self.path(shard)
+
+        try:
+            # write to a temporary file first, so an interrupted save never leaves a broken shard
+            with open(path + ".tmp", "w") as writer:
+                json.dump(items, writer, indent=4)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            return False
+        return True
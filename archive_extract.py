@@ -0,0 +1,109 @@
+import bz2, gzip, lzma, os, shutil, tarfile, zipfile, zlib
+from pathlib import Path
+from file_transfer import rename_new
+
+# members are copied by this many bytes at a time, whatever their size
+EXTRACT_BUFFER_SIZE = 1024 * 1024
+
+# openers of a single compressed file, for gz/bz2/xz files that have no tar inside
+_COMPRESSIONS = {'gz': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}
+
+# what a damaged or unsupported archive raises while it is read
+_CORRUPT_ERRORS = (zipfile.BadZipFile, tarfile.TarError, EOFError, zlib.error, lzma.LZMAError,
+                   RuntimeError, NotImplementedError)
+
+
+# The archive can not be read (damaged, encrypted, unknown format). An OSError, so the sorter reports
+# it like any other file it could not move.
+class ArchiveError(OSError):
+    pass
+
+
+# the format by the first bytes: "zip", "tar", "gz", "bz2", "xz" or None
+def detect_format(filename: Path) -> str:
+    with open(filename, 'rb') as reader:
+        header = reader.read(262)
+
+    if header[:4] in (b'PK\x03\x04', b'PK\x05\x06'):
+        return 'zip'
+    if header[:2] == b'\x1f\x8b':
+        return 'gz'
+    if header[:3] == b'BZh':
+        return 'bz2'
+    if header[:6] == b'\xfd7zXZ\x00':
+        return 'xz'
+    if header[257:262] == b'ustar':
+        return 'tar'
+    return None
+
+
+# name of the archive without its archive extensions: photos.tar.gz -> photos, notes.txt.gz -> notes.txt
+def archive_stem(filename: str) -> str:
+    stem, suffix = os.path.splitext(filename)
+    suffix = suffix.lower()
+    if suffix in ('.zip', '.tar', '.tgz', '.tbz2', '.txz'):
+        return stem
+    if suffix in ('.gz', '.bz2', '.xz'):
+        inner_stem, inner_suffix = os.path.splitext(stem)
+        return inner_stem if inner_suffix.lower() == '.tar' else stem
+    return filename
+
+
+# Yields (member name, first head_size bytes, reader of the rest) for every regular file of the archive,
+# in the order they are stored; nothing is read ahead. The reader is valid only until the next member.
+def iter_members(filename: Path, head_size: int = 0):
+    archive_format = detect_format(filename)
+    if archive_format is None:
+        raise ArchiveError(f'{filename} is not a zip, tar, gz, bz2 or xz archive')
+
+    try:
+        if archive_format == 'zip':
+            with zipfile.ZipFile(filename) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir():
+                        with archive.open(info) as reader:
+                            yield info.filename, reader.read(head_size), reader
+            return
+
+        try:
+            # streaming mode: the tar is read once from the start to the end, members are never seeked
+            archive = tarfile.open(filename, 'r|' if archive_format == 'tar' else f'r|{archive_format}')
+        except tarfile.ReadError:
+            if archive_format == 'tar':
+                raise
+            archive = None
+
+        if archive is None:
+            # not a tar inside, just one compressed file
+            with _COMPRESSIONS[archive_format](filename, 'rb') as reader:
+                yield archive_stem(Path(filename).name), reader.read(head_size), reader
+            return
+
+        with archive:
+            for member in archive:
+                if member.isreg():
+                    reader = archive.extractfile(member)
+                    yield member.name, reader.read(head_size), reader
+    except _CORRUPT_ERRORS as error:
+        raise ArchiveError(f'{filename} is damaged: {error}') from error
+
+
+# Writes head + the rest of the reader to target through a .part file, with a bounded buffer
+def write_member(head: bytes, reader, target: Path) -> None:
+    partial = target.with_name(target.name + '.part')
+    try:
+        with open(partial, 'wb') as writer:
+            writer.write(head)
+            shutil.copyfileobj(reader, writer, EXTRACT_BUFFER_SIZE)
+    except _CORRUPT_ERRORS + (OSError,) as error:
+        partial.unlink(missing_ok=True)
+        if isinstance(error, OSError):
+            raise
+        raise ArchiveError(f'{target.name} is damaged: {error}') from error
+
+    # a file that got the name meanwhile is not overwritten, the unpacking fails instead
+    try:
+        rename_new(partial, target)
+    except OSError:
+        partial.unlink(missing_ok=True)
+        raise
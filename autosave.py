@@ -0,0 +1,84 @@
+import logging
+import threading
+import time
+from typing import Callable
+
+logger = logging.getLogger("Autosave")
+
+# default flush policy: write after N seconds without new changes or after N changes, whatever comes first
+AUTOSAVE_IDLE_SECONDS = 30.0
+AUTOSAVE_MAX_CHANGES = 20
+
+
+# Background worker that coalesces changes of a book and flushes them with its own save function.
+# The input loop only calls notify(), which never waits for the disk. The save function takes the book
+# lock itself and only while it copies the state, the writing is done after the lock is released.
+class AutoSaver(threading.Thread):
+    def __init__(
+        self,
+        save_func: Callable[[], None],
+        idle_seconds: float = AUTOSAVE_IDLE_SECONDS,
+        max_changes: int = AUTOSAVE_MAX_CHANGES,
+    ) -> None:
+        super().__init__(name="autosave", daemon=True)
+        self.save_func = save_func
+        self.idle_seconds = idle_seconds
+        self.max_changes = max_changes
+        self.saves_done = 0
+
+        self._condition = threading.Condition()
+        self._pending = 0
+        self._last_change = 0.0
+        self._is_stopped = False
+
+    def notify(self, count: int = 1) -> None:
+        with self._condition:
+            self._pending += count
+            self._last_change = time.monotonic()
+            self._condition.notify()
+
+    def run(self) -> None:
+        with self._condition:
+            while not self._is_stopped:
+                if not self._pending:
+                    self._condition.wait()
+                    continue
+
+                idle_for = time.monotonic() - self._last_change
+
+                if self._pending >= self.max_changes or idle_for >= self.idle_seconds:
+                    self._flush()
+                else:
+                    self._condition.wait(self.idle_seconds - idle_for)
+
+    # called with the condition held; it is released for the save itself so notify() stays instant
+    def _flush(self) -> None:
+        pending = self._pending
+        self._pending = 0
+        self._condition.release()
+
+        try:
+            self.save_func()
+        except Exception as error:
+            logger.warning(f"Autosave failed, will retry later: {error}")
+            failed = True
+        else:
+            failed = False
+        finally:
+            self._condition.acquire()
+
+        if failed:
+            self._pending += pending
+            self._last_change = time.monotonic()
+        else:
+            self.saves_done += 1
+
+    def stop(self) -> None:
+        # pending changes are dropped: the session end ('close', 'not save', 'exit') decides about them
+        with self._condition:
+            self._is_stopped = True
+            self._pending = 0
+            self._condition.notify()
+
+        if self.is_alive():
+            self.join()
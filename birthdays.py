@@ -0,0 +1,47 @@
+# Days to the next birthday for 'show bday', 'bday in', 'stats' and 'query bday<N'. For one day (today)
+# the answer for every month/day is one table, built once from day-of-year offsets and then only looked up,
+# so a book of any size costs one table and no date objects per record.
+# Feb 29 birthdays are celebrated on Feb 28 in non-leap years.
+from datetime import date
+from functools import lru_cache
+
+_DAYS_IN_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def is_leap(year: int) -> bool:
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+
+# day of the year (0-based) the month starts on, index 1..12, index 0 is unused
+@lru_cache(maxsize=16)
+def month_starts(year: int) -> tuple:
+    starts = [0, 0]
+    for month, days in enumerate(_DAYS_IN_MONTH[:-1], start=1):
+        starts.append(starts[-1] + days + (1 if month == 2 and is_leap(year) else 0))
+    return tuple(starts)
+
+
+# table[month][day] - days from today to the next birthday on that date (0 - today), -1 for month 0 / day 0,
+# which is how a missing birthday is stored in the columns of contact_stats, and for dates that do not exist
+@lru_cache(maxsize=4)
+def days_left_table(today: date) -> tuple:
+    this_year, next_year = month_starts(today.year), month_starts(today.year + 1)
+    today_day = this_year[today.month] + today.day
+    year_length = 365 + is_leap(today.year)
+
+    table = [(-1,) * 32]
+    for month, month_days in enumerate(_DAYS_IN_MONTH, start=1):
+        row = [-1] * 32
+        for day in range(1, (29 if month == 2 else month_days) + 1):
+            this_day = 28 if (month, day) == (2, 29) and not is_leap(today.year) else day
+            left = this_year[month] + this_day - today_day
+            if left < 0:
+                next_day = 28 if (month, day) == (2, 29) and not is_leap(today.year + 1) else day
+                left = year_length - today_day + next_year[month] + next_day
+            row[day] = left
+        table.append(tuple(row))
+    return tuple(table)
+
+
+def days_to_birthday(month: int, day: int, today: date = None) -> int:
+    return days_left_table(today or date.today())[month][day]
@@ -0,0 +1,77 @@
+from collections import deque
+from contextlib import contextmanager
+
+# how many operations 'undo' can go back
+UNDO_LOG_SIZE = 100
+
+
+# One user command as a set of changes: key -> (state before, state after).
+# The states come from book.snapshot(key) and are put back with book.restore(key, state).
+class Operation:
+    def __init__(self, description: str, changes: dict) -> None:
+        self.description = description
+        self.changes = changes
+
+
+# Bounded undo/redo log of a book (AddressBook or Notebook). Every applied, undone or redone operation
+# is also passed to the listeners with the changed keys, that is how the autosave learns about changes.
+class CommandLog:
+    def __init__(self, book, max_size: int = UNDO_LOG_SIZE) -> None:
+        self.book = book
+        self.done = deque(maxlen=max_size)
+        self.undone = []
+        self.listeners = []
+
+    @contextmanager
+    def track(self, description: str, keys: list):
+        before = {key: self.book.snapshot(key) for key in keys}
+
+        try:
+            yield
+        finally:
+            changes = {}
+
+            for key, state in before.items():
+                after = self.book.snapshot(key)
+                if after != state:
+                    changes[key] = (state, after)
+
+            if changes:
+                self.record(Operation(description, changes))
+
+    def record(self, operation: Operation) -> None:
+        self.done.append(operation)
+        self.undone.clear()
+        self._notify(operation)
+
+    def undo(self) -> Operation:
+        if not self.done:
+            return None
+
+        operation = self.done.pop()
+        for key, (before, _) in operation.changes.items():
+            self.book.restore(key, before)
+
+        self.undone.append(operation)
+        self._notify(operation)
+        return operation
+
+    def redo(self) -> Operation:
+        if not self.undone:
+            return None
+
+        operation = self.undone.pop()
+        for key, (_, after) in operation.changes.items():
+            self.book.restore(key, after)
+
+        self.done.append(operation)
+        self._notify(operation)
+        return operation
+
+    def clear(self) -> None:
+        self.done.clear()
+        self.undone.clear()
+
+    def _notify(self, operation: Operation) -> None:
+        for listener in self.listeners:
+            listener(list(operation.changes))
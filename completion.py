@@ -0,0 +1,59 @@
+# Tab completion of commands and of contact names / note titles for the console
+from indexes import SortedIndex
+
+try:
+    import readline
+except ImportError:
+    # no readline (plain Windows Python): everything works, just without completion
+    readline = None
+
+# at most this many variants are shown for one Tab
+COMPLETION_LIMIT = 50
+
+
+# Completes the whole line: a command while the line is still the start of one, otherwise the name
+# after a command from name_commands. names is a SortedIndex of (casefolded name, name) that the book
+# keeps up to date itself, so completion is one bisect and a short scan however many names there are.
+class Completer:
+    def __init__(self, commands, names: SortedIndex, name_commands) -> None:
+        self.commands = SortedIndex()
+        for command in commands:
+            self.commands.add(command, command)
+        self.names = names
+        # the longest first, so "add phone" wins over "add"
+        self.name_commands = sorted(name_commands, key=len, reverse=True)
+        self._matches = []
+
+    def candidates(self, line: str) -> list:
+        folded = line.casefold()
+
+        for command in self.name_commands:
+            if folded.startswith(command + " "):
+                head = line[:len(command) + 1]
+                prefix = line[len(command) + 1:].casefold()
+                return [head + name for _, name in self.names.pairs_with_prefix(prefix, COMPLETION_LIMIT)]
+
+        return [command for command, _ in self.commands.pairs_with_prefix(folded, COMPLETION_LIMIT)]
+
+    # readline asks with state 0, 1, 2 ... until it gets None
+    def complete(self, text: str, state: int) -> str:
+        if state == 0:
+            self._matches = self.candidates(text)
+        return self._matches[state] if state < len(self._matches) else None
+
+
+# Makes the completer answer Tab in input(); returns the previous one to put back with the next call
+def set_completer(completer: Completer):
+    if readline is None:
+        return None
+
+    previous = readline.get_completer()
+    # the whole line is one "word", commands and their arguments are completed together
+    readline.set_completer_delims("")
+    readline.set_completer(completer.complete if isinstance(completer, Completer) else completer)
+    if "libedit" in (readline.__doc__ or ""):
+        # macOS ships readline on top of libedit, it has its own syntax
+        readline.parse_and_bind("bind ^I rl_complete")
+    else:
+        readline.parse_and_bind("tab: complete")
+    return previous
@@ -0,0 +1,123 @@
+# Likely duplicate contacts for the 'dedupe' command. Records are grouped by blocking keys - every phone,
+# the lowercased email and a sound-alike key (Soundex) of the name - and only records inside one block
+# are compared, so the work grows with the number of records, not with the number of pairs.
+from indexes import DistanceMatcher
+
+# names of one sound-alike block are compared with this many next names in alphabetical order
+NAME_WINDOW = 10
+
+# Soundex digit of every latin letter, 0 - vowels and letters of other alphabets
+_SOUNDEX_CODES = {
+    letter: digit
+    for digit, letters in enumerate(("aeiouyhw", "bfpv", "cgjkqsxz", "dt", "l", "mn", "r"))
+    for letter in letters
+}
+
+
+# "Robert" and "Rupert" -> "r163": the first letter and three digits of the consonants that follow
+def soundex(name: str) -> str:
+    letters = [char for char in name.casefold() if char.isalpha()]
+    if not letters:
+        return ""
+
+    digits = []
+    previous = _SOUNDEX_CODES.get(letters[0], 0)
+
+    for letter in letters[1:]:
+        digit = _SOUNDEX_CODES.get(letter, 0)
+        if digit and digit != previous:
+            digits.append(str(digit))
+            if len(digits) == 3:
+                break
+        previous = digit
+
+    return letters[0] + "".join(digits).ljust(3, "0")
+
+
+def _blocking_keys(name: str, record) -> set:
+    keys = {("phone", str(phone)) for phone in record.phones}
+
+    email = str(record.email).casefold() if record.email else ""
+    if email:
+        keys.add(("email", email))
+
+    sound = soundex(name)
+    if sound:
+        keys.add(("sound", sound))
+    return keys
+
+
+# [(names, reasons)] - groups of two or more records that are probably one person, names in
+# alphabetical order, reasons like "same phone +380631112233" or "similar names"
+def find_duplicates(book) -> list:
+    blocks = {}
+    for name, record in book.data.items():
+        for key in _blocking_keys(name, record):
+            blocks.setdefault(key, []).append(name)
+
+    # union-find over names, every link remembers why it was made
+    parents = {}
+    links = []
+
+    def root(name: str) -> str:
+        while parents.get(name, name) != name:
+            parents[name] = parents.get(parents[name], parents[name])
+            name = parents[name]
+        return name
+
+    def link(first: str, second: str, reason: str) -> None:
+        parents.setdefault(first, first)
+        parents.setdefault(second, second)
+        links.append((first, reason))
+        first, second = root(first), root(second)
+        if first != second:
+            parents[second] = first
+
+    for (kind, key), names in blocks.items():
+        if len(names) < 2:
+            continue
+
+        if kind != "sound":
+            for name in names[1:]:
+                link(names[0], name, f"same {kind} {key}")
+            continue
+
+        names.sort(key=lambda name: (name.casefold(), name))
+        for position, name in enumerate(names):
+            matcher = DistanceMatcher(name.casefold())
+            tolerance = 1 if len(name) <= 3 else 2
+            for other in names[position + 1:position + 1 + NAME_WINDOW]:
+                if matcher.distance(other.casefold(), tolerance) <= tolerance:
+                    link(name, other, "similar names")
+
+    groups = {}
+    for name in parents:
+        groups.setdefault(root(name), set()).add(name)
+
+    reasons = {}
+    for name, reason in links:
+        group_reasons = reasons.setdefault(root(name), [])
+        if reason not in group_reasons:
+            group_reasons.append(reason)
+
+    return sorted(
+        (sorted(names, key=lambda name: (name.casefold(), name)), reasons[group_root])
+        for group_root, names in groups.items()
+        if len(names) > 1
+    )
+
+
+# one save.json item out of several: phones of all of them, empty fields filled from the others
+def merge_items(items: list) -> dict:
+    merged = dict(items[0])
+    merged["Phone number"] = list(items[0]["Phone number"])
+
+    for item in items[1:]:
+        for phone in item["Phone number"]:
+            if phone not in merged["Phone number"]:
+                merged["Phone number"].append(phone)
+        for field in ("Date of birth", "email", "address"):
+            if not merged[field].strip() and item[field].strip():
+                merged[field] = item[field]
+
+    return merged
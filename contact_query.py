@@ -0,0 +1,255 @@
+# 'query' command of the address book: a list of conditions, all of them must hold.
+#   name:anna  name:an*  name:*nn*  name:~ana   exact / prefix / substring / with typos (case-insensitive)
+#   phone:+380631112233  phone:+38063*  phone:*1122*
+#   email:...  address:...                     exact / prefix / substring, like name
+#   has:email  no:address                      the field is filled / empty (email, address, bday, phone)
+#   bday<30  bday<=7  bday>300  bday=0         days left to the birthday
+# The planner takes the condition that an index answers with the fewest candidates and only checks
+# the other conditions on those candidates; without such a condition the whole book is scanned.
+
+from datetime import date
+
+from contact_validation import is_valid_phone, normalize_phone, normalize_phone_prefix
+
+FIELDS = ("name", "phone", "email", "address", "bday")
+_COMPARISONS = ("<=", ">=", "<", ">", "=")
+
+
+class QueryError(Exception):
+    pass
+
+
+# exact / prefix / substring match of one word, "*" marks the open ends
+class _Pattern:
+    def __init__(self, value: str) -> None:
+        if len(value) > 1 and value.startswith("*") and value.endswith("*"):
+            self.mode, self.value = "contains", value[1:-1]
+        elif value.endswith("*"):
+            self.mode, self.value = "prefix", value[:-1]
+        else:
+            self.mode, self.value = "exact", value
+
+    def matches(self, text: str) -> bool:
+        if self.mode == "contains":
+            return self.value in text
+        if self.mode == "prefix":
+            return text.startswith(self.value)
+        return text == self.value
+
+
+def _field_text(record, field: str) -> str:
+    value = getattr(record, field)
+    return str(value) if value else ""
+
+
+# One condition. Conditions an index can answer also have estimate() - about how many records
+# the index returns - and candidates() - the names it returns; index is the name of that index.
+class Predicate:
+    index = None
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+
+    def matches(self, record) -> bool:
+        raise NotImplementedError
+
+    def estimate(self, book) -> int:
+        return len(book.data)
+
+    def candidates(self, book) -> set:
+        return set(book.data)
+
+
+class NamePredicate(Predicate):
+    def __init__(self, text: str, value: str) -> None:
+        super().__init__(text)
+        self.is_fuzzy = value.startswith("~") and len(value) > 1
+        self.pattern = _Pattern(value[1:] if self.is_fuzzy else value.casefold())
+        self._similar = None
+
+        if self.is_fuzzy:
+            self.index = "name deletion index"
+        elif self.pattern.mode != "contains":
+            self.index = "sorted names"
+
+    def _fuzzy(self, book) -> set:
+        # the search itself is the cheap part, it is done once for the estimate and reused
+        if self._similar is None:
+            self._similar = {name for _, name in book.find_similar(self.pattern.value)}
+        return self._similar
+
+    def matches(self, record) -> bool:
+        if self.is_fuzzy:
+            return record.name.value in self._similar
+        return self.pattern.matches(record.name.value.casefold())
+
+    def estimate(self, book) -> int:
+        if self.is_fuzzy:
+            return len(self._fuzzy(book))
+        if self.index:
+            return book.sorted_names.count_with_prefix(self.pattern.value)
+        return len(book.data)
+
+    def candidates(self, book) -> set:
+        if self.is_fuzzy:
+            return self._fuzzy(book)
+        if self.index:
+            return {
+                name for key, name in book.sorted_names.pairs_with_prefix(self.pattern.value)
+                if self.pattern.mode == "prefix" or key == self.pattern.value
+            }
+        return set(book.data)
+
+
+class PhonePredicate(Predicate):
+    def __init__(self, text: str, value: str) -> None:
+        super().__init__(text)
+        self.pattern = _Pattern(value)
+        # phones are stored as +380001112233, the query may use any format 'add' accepts
+        if self.pattern.mode == "exact" and is_valid_phone(value):
+            self.pattern.value = normalize_phone(value) or value
+        elif self.pattern.mode == "prefix":
+            self.pattern.value = normalize_phone_prefix(self.pattern.value)
+        if self.pattern.mode != "contains":
+            self.index = "phone index"
+
+    def matches(self, record) -> bool:
+        return any(self.pattern.matches(str(phone)) for phone in record.phones)
+
+    def _keys(self, book) -> list:
+        if self.pattern.mode == "prefix":
+            return book.phone_index.keys_with_prefix(self.pattern.value)
+        return [self.pattern.value]
+
+    def estimate(self, book) -> int:
+        if self.index is None:
+            return len(book.data)
+        return sum(len(book.phone_index.get(key)) for key in self._keys(book))
+
+    def candidates(self, book) -> set:
+        if self.index is None:
+            return set(book.data)
+        return set().union(*(book.phone_index.get(key) for key in self._keys(book)))
+
+
+class TextPredicate(Predicate):
+    def __init__(self, text: str, field: str, value: str) -> None:
+        super().__init__(text)
+        self.field = field
+        self.pattern = _Pattern(value.casefold())
+
+    def matches(self, record) -> bool:
+        return self.pattern.matches(_field_text(record, self.field).casefold())
+
+
+class HasPredicate(Predicate):
+    def __init__(self, text: str, field: str, is_present: bool) -> None:
+        super().__init__(text)
+        self.field = "phones" if field == "phone" else "birthday" if field == "bday" else field
+        self.is_present = is_present
+
+    def matches(self, record) -> bool:
+        if self.field == "phones":
+            return bool(record.phones) == self.is_present
+        return bool(_field_text(record, self.field)) == self.is_present
+
+
+class BirthdayPredicate(Predicate):
+    def __init__(self, text: str, comparison: str, days: int) -> None:
+        super().__init__(text)
+        self.comparison = comparison
+        self.days = days
+        # one date for the whole query, not one per record
+        self.today = date.today()
+
+    def matches(self, record) -> bool:
+        if not record.birthday:
+            return False
+
+        days_left = record.birthday._days_to_birthday(self.today)
+        return {
+            "<": days_left < self.days,
+            "<=": days_left <= self.days,
+            ">": days_left > self.days,
+            ">=": days_left >= self.days,
+            "=": days_left == self.days,
+        }[self.comparison]
+
+
+def parse_query(text: str) -> list:
+    predicates = []
+
+    for token in text.split():
+        if token.casefold().startswith("bday") and not token.casefold().startswith("bday:"):
+            rest = token[len("bday"):]
+            comparison = next((sign for sign in _COMPARISONS if rest.startswith(sign)), None)
+            if comparison is None or not rest[len(comparison):].isdigit():
+                raise QueryError(f"Can not read {token}, use e.g. bday<30")
+            predicates.append(BirthdayPredicate(token, comparison, int(rest[len(comparison):])))
+            continue
+
+        field, separator, value = token.partition(":")
+        field = field.casefold()
+        if not separator or not value:
+            raise QueryError(f"Can not read {token}, use field:value, e.g. name:an*")
+
+        if field in ("has", "no"):
+            if value.casefold() not in ("email", "address", "bday", "phone"):
+                raise QueryError(f"Unknown field in {token}, use one of: email, address, bday, phone")
+            predicates.append(HasPredicate(token, value.casefold(), field == "has"))
+        elif field == "name":
+            predicates.append(NamePredicate(token, value))
+        elif field == "phone":
+            predicates.append(PhonePredicate(token, value))
+        elif field in ("email", "address"):
+            predicates.append(TextPredicate(token, field, value))
+        else:
+            raise QueryError(f"Unknown field in {token}, use one of: {', '.join(FIELDS)}, has, no")
+
+    if not predicates:
+        raise QueryError("The query is empty")
+    return predicates
+
+
+# The chosen way to answer a query: access - the indexed condition that gives the candidates
+# (None - all records), filters - the conditions checked on every candidate.
+class QueryPlan:
+    def __init__(self, access: Predicate, filters: list, estimates: dict, total: int) -> None:
+        self.access = access
+        self.filters = filters
+        self.estimates = estimates
+        self.total = total
+
+    def explain(self) -> list:
+        lines = []
+        if self.access is None:
+            lines.append(f"access: full scan of {self.total} record(s), no condition has an index")
+        else:
+            lines.append(
+                f"access: {self.access.text} via {self.access.index} (~{self.estimates[self.access]} candidate(s))"
+            )
+
+        for predicate in self.filters:
+            if predicate in self.estimates:
+                lines.append(
+                    f"filter: {predicate.text} (has {predicate.index}, ~{self.estimates[predicate]}, less selective)"
+                )
+            else:
+                lines.append(f"filter: {predicate.text}")
+        return lines
+
+    # matching records in name order
+    def run(self, book) -> list:
+        names = self.access.candidates(book) if self.access is not None else book.data.keys()
+        records = [
+            book.data[name] for name in names
+            if all(predicate.matches(book.data[name]) for predicate in self.filters)
+        ]
+        return sorted(records, key=lambda record: (record.name.value.casefold(), record.name.value))
+
+
+def plan_query(book, predicates: list) -> QueryPlan:
+    estimates = {predicate: predicate.estimate(book) for predicate in predicates if predicate.index}
+    access = min(estimates, key=estimates.get, default=None)
+    filters = [predicate for predicate in predicates if predicate is not access]
+    return QueryPlan(access, filters, estimates, len(book.data))
@@ -0,0 +1,117 @@
+# Column snapshot of the address book for 'stats' and 'bday in': one array per field instead of
+# a walk over Record objects. With NumPy the columns are NumPy arrays and every aggregate is one
+# vectorized operation; without it the same columns are plain lists and the same code paths loop.
+from collections import Counter
+from datetime import date
+
+from birthdays import days_left_table
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# bits of ContactColumns.presence
+HAS_EMAIL = 1
+HAS_ADDRESS = 2
+HAS_BIRTHDAY = 4
+HAS_PHONE = 8
+PRESENCE_FIELDS = {"email": HAS_EMAIL, "address": HAS_ADDRESS, "bday": HAS_BIRTHDAY, "phone": HAS_PHONE}
+
+class ContactColumns:
+    def __init__(self, names: list, months, days, presence, phone_codes, phone_owners) -> None:
+        self.names = names
+        # birthday month and day, 0 - no birthday
+        self.months = months
+        self.days = days
+        # HAS_* bits of every record
+        self.presence = presence
+        # operator code of every phone (063 -> 63) and the row of the record it belongs to
+        self.phone_codes = phone_codes
+        self.phone_owners = phone_owners
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def from_book(cls, book) -> "ContactColumns":
+        names, months, days, presence, phone_codes, phone_owners = [], [], [], [], [], []
+
+        for row, (name, record) in enumerate(book.data.items()):
+            bits = 0
+            if record.email and str(record.email):
+                bits |= HAS_EMAIL
+            if record.address and str(record.address):
+                bits |= HAS_ADDRESS
+            if record.birthday:
+                bits |= HAS_BIRTHDAY
+                months.append(record.birthday.value.month)
+                days.append(record.birthday.value.day)
+            else:
+                months.append(0)
+                days.append(0)
+            if record.phones:
+                bits |= HAS_PHONE
+
+            for phone in record.phones:
+                # +380 63 1112233 -> 63
+                code = str(phone)[4:6]
+                if code.isdigit():
+                    phone_codes.append(int(code))
+                    phone_owners.append(row)
+
+            names.append(name)
+            presence.append(bits)
+
+        if np is not None:
+            months, days = np.array(months, dtype=np.int16), np.array(days, dtype=np.int16)
+            presence = np.array(presence, dtype=np.uint8)
+            phone_codes = np.array(phone_codes, dtype=np.int16)
+            phone_owners = np.array(phone_owners, dtype=np.int64)
+
+        return cls(names, months, days, presence, phone_codes, phone_owners)
+
+    # days to the next birthday of every row, -1 for rows without one (month 0 is -1 in the table)
+    def days_to_birthdays(self, today: date = None):
+        table = days_left_table(today or date.today())
+
+        if np is None:
+            return [table[month][day] for month, day in zip(self.months, self.days)]
+        return np.array(table, dtype=np.int16)[self.months, self.days]
+
+    # (row, days left) of the birthdays in the next `days` days, the nearest first
+    def birthdays_within(self, days: int, today: date = None) -> list:
+        left = self.days_to_birthdays(today)
+
+        if np is None:
+            rows = [row for row, value in enumerate(left) if 0 <= value <= days]
+            return sorted(((row, left[row]) for row in rows), key=lambda pair: pair[1])
+
+        rows = np.flatnonzero((left >= 0) & (left <= days))
+        rows = rows[np.argsort(left[rows], kind="stable")]
+        return [(int(row), int(left[row])) for row in rows]
+
+    # number of birthdays in January ... December
+    def birthdays_per_month(self) -> list:
+        if np is None:
+            counts = Counter(self.months)
+            return [counts[month] for month in range(1, 13)]
+        return np.bincount(self.months, minlength=13)[1:].tolist()
+
+    # (operator code, number of contacts with a phone of that operator), the most common first
+    def contacts_per_code(self) -> list:
+        if np is None:
+            # a contact with two phones of one operator counts once
+            counts = Counter(code for code, _ in set(zip(self.phone_codes, self.phone_owners)))
+        else:
+            pairs = np.unique(np.stack([self.phone_codes, self.phone_owners]), axis=1) \
+                if len(self.phone_codes) else np.empty((2, 0), dtype=np.int64)
+            codes, numbers = np.unique(pairs[0], return_counts=True)
+            counts = dict(zip(codes.tolist(), numbers.tolist()))
+        return sorted(counts.items(), key=lambda pair: (-pair[1], pair[0]))
+
+    # field -> number of records where it is empty
+    def missing(self) -> dict:
+        if np is None:
+            return {field: sum(1 for bits in self.presence if not bits & bit) for field, bit in PRESENCE_FIELDS.items()}
+        return {field: int(np.count_nonzero((self.presence & bit) == 0)) for field, bit in PRESENCE_FIELDS.items()}
@@ -0,0 +1,114 @@
+# Validation of contacts in bulk (save.json, imports): the same rules as Phone, Email and Birthday, without
+# logging every bad value. Big lists are split into chunks that are validated in a pool of processes.
+import os, re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from functools import lru_cache
+
+# records validated by one worker at a time
+VALIDATION_CHUNK_SIZE = 5000
+# shorter lists are validated in this process, starting the workers would take longer than the work
+PARALLEL_THRESHOLD = 50000
+
+BIRTHDAY_FORMAT = "%d %B %Y"
+EMAIL_PATTERN = re.compile(r"^[\w.+\-]{1}[\w.+\-]+@\w+\.[a-z]{2,3}(\.[a-z]{2,3})?$")
+
+
+def is_valid_phone(phone: str) -> bool:
+    return 10 <= len(phone) <= 13 and phone.replace("+", "").isdigit()
+
+
+# +380001112233, 80001112233 and 0001112233 -> +380001112233, None for any other format
+def normalize_phone(phone: str) -> str:
+    if phone.startswith("+380") and len(phone) == 13:
+        return phone
+    if phone.startswith("80") and len(phone) == 11:
+        return "+3" + phone
+    if phone.startswith("0") and len(phone) == 10:
+        return "+38" + phone
+    return None
+
+
+# the first digits of a phone in the same form: 063... -> +38063..., 8063... -> +38063..., other prefixes stay
+def normalize_phone_prefix(prefix: str) -> str:
+    if not prefix.isdigit():
+        return prefix
+    if prefix.startswith("80"):
+        return "+3" + prefix
+    if prefix.startswith("0"):
+        return "+38" + prefix
+    return prefix
+
+
+def is_valid_email(email: str) -> bool:
+    return EMAIL_PATTERN.match(email) is not None
+
+
+# "10 January 2020" -> date; a book has far fewer different birthdays than records, each is parsed once
+@lru_cache(maxsize=65536)
+def parse_birthday(text: str) -> date:
+    return datetime.strptime(text, BIRTHDAY_FORMAT).date()
+
+
+# (the item with normalized phones, []) or (None, [what is wrong with it])
+def validate_item(item: dict) -> tuple:
+    errors = []
+
+    try:
+        name = item["name"]
+        phones = item["Phone number"]
+        email, address, birthday = item["email"], item["address"], item["Date of birth"]
+    except (KeyError, TypeError) as error:
+        return None, [f"missing field {error}"]
+
+    if not isinstance(name, str) or not name.strip():
+        errors.append("empty name")
+
+    normalized_phones = []
+    if not phones:
+        errors.append("no phones")
+    for phone in map(str, phones):
+        normalized = normalize_phone(phone) if is_valid_phone(phone) else None
+        if normalized is None:
+            errors.append(f"wrong phone {phone}")
+        elif normalized not in normalized_phones:
+            normalized_phones.append(normalized)
+
+    if email and not is_valid_email(email):
+        errors.append(f"wrong email {email}")
+
+    if birthday:
+        try:
+            parse_birthday(birthday)
+        except (ValueError, TypeError):
+            errors.append(f"wrong birthday {birthday}")
+
+    if errors:
+        return None, errors
+
+    return {"name": name, "Phone number": normalized_phones, "email": email, "address": address,
+            "Date of birth": birthday}, []
+
+
+def validate_chunk(items: list) -> list:
+    return [validate_item(item) for item in items]
+
+
+# (valid items, [(position in items, item, errors)]), the valid ones in their original order
+def validate_items(items: list, workers: int = None) -> tuple:
+    workers = workers or os.cpu_count() or 1
+    # with one core the workers only add the cost of sending the items to them and back
+    if len(items) < PARALLEL_THRESHOLD or workers < 2:
+        results = validate_chunk(items)
+    else:
+        chunks = [items[start:start + VALIDATION_CHUNK_SIZE] for start in range(0, len(items), VALIDATION_CHUNK_SIZE)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = [result for chunk in executor.map(validate_chunk, chunks) for result in chunk]
+
+    valid, invalid = [], []
+    for position, (item, (normalized, errors)) in enumerate(zip(items, results)):
+        if errors:
+            invalid.append((position, item, errors))
+        else:
+            valid.append(normalized)
+    return valid, invalid
@@ -1,50 +1,153 @@
+import json, os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-JPEG_IMAGES = []
-JPG_IMAGES = []
-PNG_IMAGES = []
-SVG_IMAGES = []
-MP3_AUDIO = []
-MP4_VIDEO = []
-MY_OTHER = []
-ARCHIVES = []
-
-REGISTER_EXTENSION = {
-    'JPEG': JPEG_IMAGES,
-    'JPG': JPG_IMAGES,
-    'PNG': PNG_IMAGES,
-    'SVG': SVG_IMAGES,
-    'MP3': MP3_AUDIO,
-    'MP4': MP4_VIDEO,
-    'ZIP': ARCHIVES
-}
-
-FOLDERS = []
-EXTENSION = set()
-UNKNOWN = set()
+# extensions and magic bytes of every category, see Category for the format of one entry
+CATEGORIES_FILE = Path(__file__).with_name('sort_categories.json')
+# files without a known extension are sniffed by this many per worker, with this many workers
+SNIFF_BATCH_SIZE = 256
+SNIFF_WORKERS = 8
+
+
+# One destination of the sorter.
+#   folder: where the files go, relative to the sorted folder ("images/PNG")
+#   kind: "move" the file there or "unpack" it there as an archive
+#   extensions: upper case, without the dot
+#   signatures: {"offset": 0, "hex": "89504E47"} or {"offset": 4, "text": "ftyp"} - bytes the file starts with
+class Category:
+    def __init__(self, folder: str, kind: str = 'move', extensions: list = (), signatures: list = ()) -> None:
+        self.folder = folder
+        self.kind = kind
+        self.extensions = [extension.upper() for extension in extensions]
+        self.signatures = [
+            (signature['offset'], bytes.fromhex(signature['hex']) if 'hex' in signature
+             else signature['text'].encode('utf-8'))
+            for signature in signatures
+        ]
+
+
+class CategoryRegistry:
+    def __init__(self, categories: list, other: Category) -> None:
+        self.categories = categories
+        self.other = other
+        self.by_extension = {}
+        self.signatures = []
+
+        for category in categories:
+            for extension in category.extensions:
+                self.by_extension.setdefault(extension, category)
+            for offset, magic in category.signatures:
+                self.signatures.append((offset, magic, category))
+
+        # how much of a file sniffing ever needs
+        self.header_size = max((offset + len(magic) for offset, magic, _ in self.signatures), default=0)
+
+    @classmethod
+    def load(cls, filename: Path = CATEGORIES_FILE) -> 'CategoryRegistry':
+        with open(filename, encoding='utf-8') as reader:
+            config = json.load(reader)
+        return cls([Category(**item) for item in config['categories']], Category(config['other']))
+
+    # top level folders made by the sorter, scan() does not go into them
+    def top_folders(self) -> tuple:
+        return tuple({category.folder.split('/')[0] for category in self.categories + [self.other]})
+
+    # A file with an extension nobody registered (.docx, .jar, .epub ...) is often a zip or gzip inside, but
+    # it is a document or a program and not an archive to unpack: such a file is only ever moved, it goes
+    # to other when its bytes point at an unpack category. Only a file without any extension can be unpacked.
+    def match_header(self, header: bytes, has_extension: bool = False) -> Category:
+        for offset, magic, category in self.signatures:
+            if header[offset:offset + len(magic)] == magic:
+                return self.other if has_extension and category.kind == 'unpack' else category
+        return self.other
+
+    # category of a file that is not on disk (a member of an archive): by the extension, else by the first bytes
+    def match(self, filename: str, header: bytes) -> Category:
+        extension = get_extension(filename)
+        category = self.by_extension.get(extension)
+        return category if category is not None else self.match_header(header, bool(extension))
+
+    def _sniff_one(self, file: Path) -> Category:
+        try:
+            with open(file, 'rb') as reader:
+                header = reader.read(self.header_size)
+        except OSError:
+            return self.other
+        return self.match_header(header, bool(get_extension(file.name)))
+
+    def _sniff_batch(self, files: list) -> list:
+        return [self._sniff_one(file) for file in files]
+
+    def sniff(self, files: list) -> list:
+        if not self.signatures or not files:
+            return [self.other] * len(files)
+
+        batches = [files[start:start + SNIFF_BATCH_SIZE] for start in range(0, len(files), SNIFF_BATCH_SIZE)]
+        if len(batches) == 1:
+            return self._sniff_batch(files)
+
+        with ThreadPoolExecutor(max_workers=SNIFF_WORKERS) as executor:
+            return [category for batch in executor.map(self._sniff_batch, batches) for category in batch]
+
+    # category -> files; one dict lookup per file, only files with an unknown extension are opened
+    def categorize(self, files: list) -> dict:
+        result = {}
+        unknown = []
+
+        for file in files:
+            category = self.by_extension.get(get_extension(file.name))
+            if category is None:
+                unknown.append(file)
+            else:
+                result.setdefault(category, []).append(file)
+
+        for file, category in zip(unknown, self.sniff(unknown)):
+            result.setdefault(category, []).append(file)
+
+        return result
+
+
+REGISTRY = CategoryRegistry.load()
+
+# folders made by the sorter (and 'archives', 'documents' from older versions), they are never rescanned
+SORTED_FOLDERS = tuple(sorted({'archives', 'documents', *REGISTRY.top_folders()}))
 
 
 def get_extension(filename: str) -> str:
     return Path(filename).suffix[1:].upper()
 
 
-def scan(folder: Path) -> None:
-    for item in folder.iterdir():
+# all files to sort and all folders to visit under the folder, the folders from the top to the bottom;
+# progress(number of files found so far) is called after every listed folder
+def scan(folder: Path, manifest=None, progress=None) -> tuple:
+    files = []
+    folders = []
+    _scan(folder, manifest, files, folders, progress)
+    return files, folders
+
+
+def _scan(folder: Path, manifest, files: list, folders: list, progress=None) -> None:
+    # a folder the manifest knows as unchanged is not listed, only its remembered subfolders are visited
+    if manifest is not None and manifest.is_unchanged(folder):
+        for subfolder in manifest.subfolders(folder):
+            folders.append(subfolder)
+            _scan(subfolder, manifest, files, folders, progress)
+        return
+
+    with os.scandir(folder) as entries:
+        items = list(entries)
+
+    for item in items:
         if item.is_dir():
-            if item.name not in ('archives', 'video', 'audio', 'documents', 'images', 'MY_OTHER'):
-                FOLDERS.append(item)
-                scan(item)
+            if item.name not in SORTED_FOLDERS:
+                folders.append(folder / item.name)
+                _scan(folder / item.name, manifest, files, folders, progress)
             continue
 
-        ext = get_extension(item.name)
-        fullname = folder / item.name
-        if not ext:
-            MY_OTHER.append(fullname)
-        else:
-            try:
-                container = REGISTER_EXTENSION[ext]
-                EXTENSION.add(ext)
-                container.append(fullname)
-            except KeyError:
-                UNKNOWN.add(ext)
-                MY_OTHER.append(fullname)
+        if manifest is not None and item.name == manifest.path.name:
+            continue
+
+        files.append(folder / item.name)
+
+    if progress is not None:
+        progress(len(files))
@@ -1,6 +1,11 @@
-import shutil, re
+import json, os, shutil, re, threading, time
+from functools import lru_cache
 from pathlib import Path
 import file_parser as parser
+from sort_manifest import SortManifest
+from file_transfer import BandwidthBudget, TransferPool, move_file
+from sort_progress import REPORT_FILE, SortProgress, format_size
+from archive_extract import archive_stem, iter_members, write_member
 
 
 CYRILLIC_SYMBOLS = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюяєіїґ'
@@ -14,73 +19,439 @@ for c, l in zip(CYRILLIC_SYMBOLS, TRANSLATION):
     TRANS[ord(c.upper())] = l.upper()
 
 
+# everything except latin letters, digits, "_" and "." becomes "_"
+NAME_PATTERN = re.compile(r'[^\w.]', re.ASCII)
+
+
+# the same names (IMG_0001.jpg, document.pdf ...) come again and again, so the results are cached
+@lru_cache(maxsize=65536)
 def normalize(name: str) -> str:
     normalized_name = name.translate(TRANS)
-    normalized_name = re.sub(r'\W^.', '_', normalized_name)
+    normalized_name = NAME_PATTERN.sub('_', normalized_name)
     return normalized_name
 
 
-def handle_media(filename: Path, target_folder: Path) -> None:
-    target_folder.mkdir(exist_ok=True, parents=True)
-    filename.replace(target_folder / normalize(filename.name))
+# Gives every file a free name in its target folder. Each target folder is listed once, after that
+# the taken names are kept in a set, so there is no stat per file and two files never get the same name.
+class NameResolver:
+    def __init__(self) -> None:
+        self.taken = {}
+
+    def _taken_in(self, folder: Path) -> set:
+        names = self.taken.get(folder)
+        if names is None:
+            try:
+                names = set(os.listdir(folder))
+            except FileNotFoundError:
+                names = set()
+            self.taken[folder] = names
+        return names
+
+    # name -> name, name_1, name_2 ... whichever is free first
+    def resolve(self, folder: Path, name: str) -> str:
+        names = self._taken_in(folder)
+        free_name = name
+        stem, suffix = os.path.splitext(name)
+        number = 0
 
+        while free_name in names:
+            number += 1
+            free_name = f'{stem}_{number}{suffix}'
 
-def handle_other(filename: Path, target_folder: Path) -> None:
+        names.add(free_name)
+        return free_name
+
+    # takes the name if it is free, False if a file has it already or it was given out before
+    def reserve(self, folder: Path, name: str) -> bool:
+        names = self._taken_in(folder)
+        if name in names:
+            return False
+        names.add(name)
+        return True
+
+
+def handle_media(filename: Path, target_folder: Path, budget: BandwidthBudget = None,
+                 target_name: str = None) -> None:
     target_folder.mkdir(exist_ok=True, parents=True)
-    filename.replace(target_folder / normalize(filename.name))
+    move_file(filename, target_folder / (target_name or normalize(filename.name)), budget)
 
 
-def handle_archive(filename: Path, target_folder: Path) -> None:
+def handle_other(filename: Path, target_folder: Path, budget: BandwidthBudget = None,
+                 target_name: str = None) -> None:
     target_folder.mkdir(exist_ok=True, parents=True)
-    folder_for_file = target_folder / \
-        normalize(filename.name.replace(filename.suffix, ''))
-    folder_for_file.mkdir(exist_ok=True, parents=True)
+    move_file(filename, target_folder / (target_name or normalize(filename.name)), budget)
+
+
+# Unpacks zip/tar/tar.gz/bz2/xz/gz member by member straight into folder_for_file/<category folder>/,
+# so the unpacked files are sorted in the same pass. If a member is damaged, the unpacking stops,
+# everything unpacked from this archive is removed and the archive stays where it was (ArchiveError).
+def handle_archive(filename: Path, target_folder: Path, target_name: str = None) -> None:
+    folder_for_file = target_folder / (target_name or normalize(archive_stem(filename.name)))
+    is_new_folder = not folder_for_file.exists()
+    names = NameResolver()
+    written = []
+
     try:
-        try:
-            shutil.unpack_archive(filename, folder_for_file)
-        except shutil.ReadError:
-            folder_for_file.rmdir()
+        for member_name, head, reader in iter_members(filename, parser.REGISTRY.header_size):
+            name = normalize(Path(member_name).name)
+            if not name:
+                continue
+            member_folder = folder_for_file / parser.REGISTRY.match(name, head).folder
+            member_folder.mkdir(exist_ok=True, parents=True)
+            target = member_folder / names.resolve(member_folder, name)
+            write_member(head, reader, target)
+            written.append(target)
     except OSError:
-        print(f"{OSError}: ваші архіви видалено!")
+        if is_new_folder:
+            shutil.rmtree(folder_for_file, ignore_errors=True)
+        else:
+            for target in written:
+                target.unlink(missing_ok=True)
+        raise
+
+    folder_for_file.mkdir(exist_ok=True, parents=True)
     filename.unlink()
 
 
+# an emptied folder; OSError if something is still in it, the caller reports it
 def handle_folder(folder: Path) -> None:
-    try:
-        folder.rmdir()
-    except OSError:
-        print(f"Can't delete folder: {folder}")
+    folder.rmdir()
+
+
+# where "plan <folder>" keeps the plan for a later "run plan"
+PLAN_FILE = "sort_plan.json"
+
+# "watch <folder>": seconds between polls, seconds a file must keep its size to count as complete,
+# files sorted at once
+WATCH_INTERVAL = 1.0
+WATCH_SETTLE_TIME = 2.0
+WATCH_BATCH_SIZE = 50
+
+
+# One planned step: "move" a file, "unpack" an archive or "delete" a folder that became empty
+class SortAction:
+    def __init__(self, kind: str, source: Path, target: Path, category: str = "", size: int = 0,
+                 is_cross_device: bool = False, mtime: int = 0) -> None:
+        self.kind = kind
+        self.source = Path(source)
+        self.target = Path(target)
+        self.category = category
+        self.size = size
+        self.is_cross_device = is_cross_device
+        self.mtime = mtime
+
+    def to_dict(self) -> dict:
+        return {"kind": self.kind, "source": str(self.source), "target": str(self.target),
+                "category": self.category, "size": self.size, "is_cross_device": self.is_cross_device,
+                "mtime": self.mtime}
+
+    @classmethod
+    def from_dict(cls, item: dict) -> "SortAction":
+        return cls(**item)
+
+
+class SortPlan:
+    def __init__(self, folder: Path, actions: list = None, collisions: list = None) -> None:
+        self.folder = Path(folder)
+        self.actions = actions if actions is not None else []
+        # (source, target) pairs that got a numbered name because the normalized one was taken
+        self.collisions = collisions if collisions is not None else []
+
+    def report(self) -> str:
+        moves = [action for action in self.actions if action.kind == "move"]
+        archives = [action for action in self.actions if action.kind == "unpack"]
+        folders = [action for action in self.actions if action.kind == "delete"]
+        copies = [action for action in moves + archives if action.is_cross_device]
+        per_category = {}
+
+        for action in moves + archives:
+            count, size = per_category.get(action.category, (0, 0))
+            per_category[action.category] = (count + 1, size + action.size)
+
+        lines = [f"Plan for {self.folder}:",
+                 f"files: {len(moves) + len(archives)} ({format_size(sum(a.size for a in moves + archives))})"]
+        for category, (count, size) in sorted(per_category.items()):
+            lines.append(f"    {category}: {count} file(s), {format_size(size)}")
+        lines.append(f"archives to unpack: {len(archives)}")
+        lines.append(f"folders to remove: {len(folders)}")
+        lines.append(f"cheap renames: {len(moves) + len(archives) - len(copies)}, "
+                     f"cross-device copies: {len(copies)} ({format_size(sum(a.size for a in copies))})")
+        lines.append(f"name collisions (renamed): {len(self.collisions)}")
+        for source, target in self.collisions:
+            lines.append(f"    {source} -> {target}")
+        return "\n".join(lines)
+
+    def save(self, filename: str) -> None:
+        data = {"folder": str(self.folder), "actions": [action.to_dict() for action in self.actions],
+                "collisions": [[str(source), str(target)] for source, target in self.collisions]}
+        with open(filename, "w") as writer:
+            json.dump(data, writer, indent=4)
+
+    @classmethod
+    def load(cls, filename: str) -> "SortPlan":
+        with open(filename) as reader:
+            data = json.load(reader)
+        return cls(data["folder"], [SortAction.from_dict(item) for item in data["actions"]],
+                   [(Path(source), Path(target)) for source, target in data["collisions"]])
+
+
+# device of the folder or of its closest existing parent: files on another device need a copy, not a rename
+def _device_of(folder: Path, devices: dict) -> int:
+    if folder not in devices:
+        path = folder
+        while not path.exists() and path != path.parent:
+            path = path.parent
+        devices[folder] = path.stat().st_dev
+    return devices[folder]
+
+
+def build_plan(folder: Path, manifest: SortManifest = None, progress: SortProgress = None) -> SortPlan:
+    folder = Path(folder)
+    progress = progress if progress is not None else SortProgress(show=False)
+    with progress.stage("scan"):
+        files, folders = parser.scan(folder, manifest, progress.scanned)
+
+    with progress.stage("plan"):
+        plan = _plan_files(folder, files, folders)
+    return plan
+
+
+def _plan_files(folder: Path, files: list, folders: list) -> SortPlan:
+    plan = SortPlan(folder)
+    devices = {}
+    names = NameResolver()
+
+    for category, category_files in parser.REGISTRY.categorize(files).items():
+        kind = category.kind
+        target_folder = folder / category.folder
+
+        # sorted, so the same files get the same numbered names on every run
+        for file in sorted(category_files):
+            stat = file.stat()
+            if kind == "unpack":
+                name = normalize(archive_stem(file.name))
+            else:
+                name = normalize(file.name)
+
+            target = target_folder / names.resolve(target_folder, name)
+            if target.name != name:
+                plan.collisions.append((file, target))
+
+            # unpacking writes new files anyway, only a move can be a cheap rename
+            is_cross_device = kind == "move" and stat.st_dev != _device_of(target_folder, devices)
+            plan.actions.append(SortAction(kind, file, target, category.folder, stat.st_size, is_cross_device,
+                                           stat.st_mtime_ns))
+
+    for empty_folder in folders[::-1]:
+        plan.actions.append(SortAction("delete", empty_folder, empty_folder))
+
+    return plan
+
+
+# With a stop_event the run can be stopped between two files: what is done stays sorted,
+# the rest stays where it was and no folder is marked as unchanged.
+def execute_plan(plan: SortPlan, manifest: SortManifest = None, transfers: TransferPool = None,
+                 progress: SortProgress = None, stop_event: threading.Event = None) -> None:
+    progress = progress if progress is not None else SortProgress(show=False)
+    files = [action for action in plan.actions if action.kind != "delete"]
+    progress.planned(len(files), sum(action.size for action in files))
+    own_transfers = None
+    copies = []
+    # the targets were free when the plan was made; a file that got there since is not overwritten,
+    # the action gets the next free name instead
+    names = NameResolver()
+
+    for action in files:
+        if stop_event is not None and stop_event.is_set():
+            break
+
+        if not action.source.exists():
+            progress.skip(action.source)
+            continue
+
+        if not names.reserve(action.target.parent, action.target.name):
+            free_target = action.target.parent / names.resolve(action.target.parent, action.target.name)
+            plan.collisions.append((action.source, free_target))
+            action.target = free_target
+
+        try:
+            if action.kind == "unpack":
+                with progress.stage("unpack"):
+                    handle_archive(action.source, action.target.parent, action.target.name)
+                progress.unpacked(action.size)
+            elif action.is_cross_device:
+                # copies to another disk run in the background while the cheap renames go on
+                if transfers is None:
+                    transfers = own_transfers = TransferPool()
+                copies.append((action, transfers.submit(handle_media, action.source, action.target.parent,
+                                                        target_name=action.target.name)))
+            else:
+                with progress.stage("move"):
+                    handle_media(action.source, action.target.parent, target_name=action.target.name)
+                progress.moved(action.size)
+        except OSError as error:
+            progress.error(action.source, error)
+
+    # the time spent waiting for the copies is what they cost on top of the renames
+    with progress.stage("move"):
+        for action, copy in copies:
+            try:
+                copy.result()
+            except OSError as error:
+                progress.error(action.source, error)
+                continue
+            progress.moved(action.size)
+
+        if own_transfers is not None:
+            own_transfers.shutdown()
+
+    is_stopped = stop_event is not None and stop_event.is_set()
+
+    with progress.stage("cleanup"):
+        for action in plan.actions:
+            if action.kind == "delete" and not is_stopped:
+                try:
+                    handle_folder(action.source)
+                except FileNotFoundError:
+                    progress.skip(action.source)
+                    continue
+                except OSError as error:
+                    # a file that could not be sorted is still there, or a new one has arrived
+                    progress.error(action.source, error)
+                    continue
+                progress.removed_folder()
+
+    if manifest is not None:
+        with progress.stage("manifest"):
+            # folders that are left now have nothing to sort, the next run skips them while they stay the same
+            for action in plan.actions:
+                if action.kind == "delete" and not is_stopped:
+                    if action.source.exists():
+                        manifest.record_folder(action.source)
+                    else:
+                        manifest.forget_folder(action.source)
+            if not is_stopped:
+                manifest.record_folder(plan.folder)
+            manifest.save()
+
+
+# Sorts new files as they arrive. Every poll is build_plan() with the manifest, so while nothing changes
+# it costs a stat of the folder and of the known subfolders. A file is sorted only after its size and
+# time of change stay the same for settle_time seconds (no half-downloaded files).
+def watch(folder: Path, interval: float = WATCH_INTERVAL, settle_time: float = WATCH_SETTLE_TIME,
+          batch_size: int = WATCH_BATCH_SIZE, stop_event: threading.Event = None) -> None:
+    folder = Path(folder)
+    stop_event = stop_event if stop_event is not None else threading.Event()
+    manifest = SortManifest(folder)
+    # source -> ((size, mtime), time when it was seen like that first)
+    pending = {}
+    # source -> (size, mtime) it could not be sorted with; it is tried again only after it changes
+    failed = {}
+
+    while not stop_event.is_set():
+        plan = build_plan(folder, manifest)
+        now = time.monotonic()
+        ready = []
+        seen = set()
+
+        for action in plan.actions:
+            if action.kind == "delete":
+                continue
+
+            seen.add(action.source)
+            signature = (action.size, action.mtime)
+            if failed.get(action.source) == signature:
+                continue
+            failed.pop(action.source, None)
+            known = pending.get(action.source)
+
+            if known is None or known[0] != signature:
+                pending[action.source] = (signature, now)
+            elif now - known[1] >= settle_time:
+                ready.append(action)
+
+        for source in list(pending):
+            if source not in seen:
+                del pending[source]
+        for source in list(failed):
+            if source not in seen:
+                del failed[source]
+
+        for start in range(0, len(ready), batch_size):
+            batch = ready[start:start + batch_size]
+            progress = SortProgress(show=False)
+            execute_plan(SortPlan(folder, batch), manifest, progress=progress)
+            signatures = {str(action.source): (action.size, action.mtime) for action in batch}
+            for error in progress.errors:
+                print(f"Could not sort {error['path']}: {error['error']}")
+                failed[Path(error['path'])] = signatures[error['path']]
+            for action in batch:
+                pending.pop(action.source, None)
+            if progress.files_moved:
+                print(f"Sorted {progress.files_moved} new file(s) in {folder}")
+
+        if ready and not pending:
+            # everything that arrived is sorted, now the emptied folders can go
+            execute_plan(SortPlan(folder, [a for a in plan.actions if a.kind == "delete"]), manifest)
+
+        stop_event.wait(interval)
+
+
+# 'plan <folder>' + 'run plan' in one go, for sort_async and other callers that do not print
+def sort(folder: Path, use_manifest: bool = True, progress: SortProgress = None,
+         stop_event: threading.Event = None) -> SortProgress:
+    folder = Path(folder)
+    progress = progress if progress is not None else SortProgress(show=False)
+    manifest = SortManifest(folder) if use_manifest else None
+    plan = build_plan(folder, manifest, progress)
+
+    if stop_event is None or not stop_event.is_set():
+        execute_plan(plan, manifest, progress=progress, stop_event=stop_event)
+    progress.finish()
+    return progress
 
 
 def main() -> None:
     while True:
         input_line = input(
-            'Please select your folder to sort. For exit, type "exit": ')
+            'Please select your folder to sort ("plan <folder>" only shows what will be done, '
+            '"run plan" sorts by the last plan, "watch <folder>" keeps sorting new files). For exit, type "exit": ')
         if input_line == "exit":
             break
-        folder = Path(input_line)
-        parser.scan(folder)
-        for file in parser.JPEG_IMAGES:
-            handle_media(file, folder / 'images' / 'JPEG')
-        for file in parser.JPG_IMAGES:
-            handle_media(file, folder / 'images' / 'JPG')
-        for file in parser.PNG_IMAGES:
-            handle_media(file, folder / 'images' / 'PNG')
-        for file in parser.SVG_IMAGES:
-            handle_media(file, folder / 'images' / 'SVG')
-        for file in parser.MP3_AUDIO:
-            handle_media(file, folder / 'audio')
-        for file in parser.MP4_VIDEO:
-            handle_media(file, folder / 'video')
-
-        for file in parser.MY_OTHER:
-            handle_media(file, folder / 'MY_OTHER')
-        for file in parser.ARCHIVES:
-            handle_archive(file, folder / 'ARCHIVES')
-
-        for folder in parser.FOLDERS[::-1]:
-            handle_folder(folder)
-        print('The folder has been succesfully sorted')
+
+        if input_line.startswith("watch "):
+            folder = Path(input_line[len("watch "):])
+            print(f"Watching {folder}, press Ctrl+C to stop")
+            try:
+                watch(folder)
+            except KeyboardInterrupt:
+                print("Stopped watching")
+            continue
+
+        if input_line.startswith("plan "):
+            folder = Path(input_line[len("plan "):])
+            plan = build_plan(folder, SortManifest(folder))
+            plan.save(PLAN_FILE)
+            print(plan.report())
+            print(f'The plan is saved to {PLAN_FILE}, type "run plan" to sort by it')
+            continue
+
+        progress = SortProgress()
+        if input_line == "run plan":
+            try:
+                plan = SortPlan.load(PLAN_FILE)
+            except FileNotFoundError:
+                print('There is no plan yet, make one with "plan <folder>"')
+                continue
+            manifest = SortManifest(plan.folder)
+        else:
+            manifest = SortManifest(Path(input_line))
+            plan = build_plan(Path(input_line), manifest, progress)
+
+        execute_plan(plan, manifest, progress=progress)
+        progress.finish()
+        progress.save(REPORT_FILE)
+        print(f'The folder has been succesfully sorted, the run report is saved to {REPORT_FILE}')
 
 
 if __name__ == "__main__":
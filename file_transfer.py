@@ -0,0 +1,125 @@
+import errno, os, shutil, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+# copies to another disk that may run at once, and their common speed limit (bytes per second, None - no limit)
+MAX_COPY_STREAMS = 4
+BANDWIDTH_LIMIT = None
+
+
+
+# Token bucket shared by all copy streams: spend() waits until the bytes fit into the budget
+class BandwidthBudget:
+    def __init__(self, bytes_per_second: int) -> None:
+        self.bytes_per_second = bytes_per_second
+        self._available = float(bytes_per_second)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def spend(self, amount: int) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._available = min(self.bytes_per_second,
+                                  self._available + (now - self._updated) * self.bytes_per_second)
+            self._updated = now
+            self._available -= amount
+            delay = -self._available / self.bytes_per_second if self._available < 0 else 0
+
+        if delay:
+            time.sleep(delay)
+
+
+# Copies with copy_file_range (in-kernel, even reflink/server-side where the filesystems can), then sendfile,
+# then plain reads and writes, whatever the system supports first. The zero-copy calls are missing on some
+# systems (Windows) or refuse regular files (sendfile on macOS), so any error of theirs only means the next way
+# is tried; the plain reads and writes work everywhere and their errors are real.
+def _copy_chunk(reader, writer, offset: int, count: int, method: list) -> int:
+    while method[0] != 'write':
+        try:
+            if method[0] == 'copy_file_range':
+                return os.copy_file_range(reader.fileno(), writer.fileno(), count, offset)
+            return os.sendfile(writer.fileno(), reader.fileno(), offset, count)
+        except (AttributeError, OSError):
+            method[0] = 'sendfile' if method[0] == 'copy_file_range' else 'write'
+
+    # a failed zero-copy call may have moved the file positions
+    reader.seek(offset)
+    writer.seek(offset)
+    return writer.write(reader.read(count))
+
+
+def copy_file(source: Path, target: Path, budget: BandwidthBudget = None) -> None:
+    source, target = Path(source), Path(target)
+    partial = target.with_name(target.name + '.part')
+    method = ['copy_file_range']
+
+    with open(source, 'rb') as reader, open(partial, 'wb') as writer:
+        before = os.fstat(reader.fileno())
+        copied = 0
+
+        while copied < before.st_size:
+            count = min(COPY_CHUNK_SIZE, before.st_size - copied)
+            if budget is not None:
+                budget.spend(count)
+            sent = _copy_chunk(reader, writer, copied, count, method)
+            if not sent:
+                break
+            copied += sent
+
+    after = os.stat(source)
+    if copied != before.st_size or os.stat(partial).st_size != before.st_size \
+            or (after.st_size, after.st_mtime_ns) != (before.st_size, before.st_mtime_ns):
+        partial.unlink()
+        raise OSError(errno.EIO, f'Copy of {source} is not complete or the file changed meanwhile')
+
+    shutil.copystat(source, partial)
+    try:
+        rename_new(partial, target)
+    except OSError:
+        partial.unlink()
+        raise
+    source.unlink()
+
+
+# A rename that never replaces an existing target (FileExistsError): a hard link and removal of the source,
+# so the check and the rename are one step; on filesystems without hard links the target is checked right before
+def rename_new(source: Path, target: Path) -> None:
+    try:
+        os.link(source, target, follow_symlinks=False)
+    except OSError as error:
+        if error.errno in (errno.EEXIST, errno.EXDEV, errno.ENOENT):
+            raise
+        if os.path.lexists(target):
+            raise FileExistsError(errno.EEXIST, 'The target exists already', str(target))
+        Path(source).rename(target)
+        return
+
+    os.unlink(source)
+
+
+# A rename where it is possible, a verified copy + removal of the source when the target is on another disk.
+# An existing target is never replaced (FileExistsError). Returns True if the file had to be copied.
+def move_file(source: Path, target: Path, budget: BandwidthBudget = None) -> bool:
+    try:
+        rename_new(source, target)
+        return False
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+
+    copy_file(source, target, budget)
+    return True
+
+
+# Runs copies to other disks in parallel, at most max_streams at once and all of them within one budget
+class TransferPool:
+    def __init__(self, max_streams: int = MAX_COPY_STREAMS, bytes_per_second: int = BANDWIDTH_LIMIT) -> None:
+        self.budget = BandwidthBudget(bytes_per_second) if bytes_per_second else None
+        self._executor = ThreadPoolExecutor(max_workers=max_streams, thread_name_prefix='copy')
+
+    def submit(self, func, *args, **kwargs):
+        return self._executor.submit(func, *args, budget=self.budget, **kwargs)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
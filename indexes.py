@@ -0,0 +1,384 @@
+# In-memory search structures shared by the address book and the notebook
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice, takewhile
+
+
+# Levenshtein distance; stops early and returns limit + 1 when the words are further apart than limit
+def edit_distance(first: str, second: str, limit: int = None) -> int:
+    return DistanceMatcher(first).distance(second, limit)
+
+
+# Bit-parallel Levenshtein (Myers / Hyyrö): the pattern is turned into per-character bitmasks once,
+# after that every comparison costs one pass of integer operations over the other word.
+class DistanceMatcher:
+    def __init__(self, pattern: str) -> None:
+        self.pattern = pattern
+        self.length = len(pattern)
+        self.full_mask = (1 << self.length) - 1
+        self.last_bit = 1 << (self.length - 1) if pattern else 0
+        self.char_masks = {}
+
+        for position, char in enumerate(pattern):
+            self.char_masks[char] = self.char_masks.get(char, 0) | (1 << position)
+
+    def distance(self, word: str, limit: int = None) -> int:
+        if limit is not None and abs(len(word) - self.length) > limit:
+            return limit + 1
+
+        if not self.length:
+            return len(word)
+
+        full_mask = self.full_mask
+        last_bit = self.last_bit
+        char_masks = self.char_masks
+        positive = full_mask
+        negative = 0
+        score = self.length
+        # with every step the score can drop by at most one, that is enough to stop early
+        steps_left = len(word)
+
+        for char in word:
+            equal = char_masks.get(char, 0)
+            vertical = equal | negative
+            horizontal = (((equal & positive) + positive) ^ positive) | equal
+            horizontal_positive = negative | (~(horizontal | positive) & full_mask)
+            horizontal_negative = positive & horizontal
+
+            if horizontal_positive & last_bit:
+                score += 1
+            elif horizontal_negative & last_bit:
+                score -= 1
+
+            steps_left -= 1
+
+            if limit is not None and score - steps_left > limit:
+                return limit + 1
+
+            horizontal_positive = ((horizontal_positive << 1) | 1) & full_mask
+            horizontal_negative = (horizontal_negative << 1) & full_mask
+            positive = horizontal_negative | (~(vertical | horizontal_positive) & full_mask)
+            negative = horizontal_positive & vertical
+
+        if limit is not None and score > limit:
+            return limit + 1
+
+        return score
+
+
+# Symmetric delete index (SymSpell) for lookups with typos. Every key is stored under all the strings its
+# first PREFIX_LENGTH letters give with up to max_distance deletions. Two words within distance d always
+# share such a string with at most d deletions on each side (the cut to the prefix keeps that true), so a
+# search is a few dozen dict lookups for the deletions of the query and an exact check of the keys found
+# there, however many keys the index holds.
+class DeletionIndex:
+    PREFIX_LENGTH = 7
+
+    def __init__(self, max_distance: int = 2) -> None:
+        self.max_distance = max_distance
+        # key -> set of items stored under it
+        self.items = {}
+        # deletion -> the key it comes from, or a list of keys when there are several (most have one);
+        # a key is added once, so the lists have no repeats, and they take far less memory than sets
+        self.deletions = {}
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _deletions(self, key: str, distance: int) -> set:
+        found = {key[:self.PREFIX_LENGTH]}
+        layer = found
+
+        for _ in range(distance):
+            layer = {word[:position] + word[position + 1:] for word in layer for position in range(len(word))}
+            found |= layer
+        return found
+
+    def add(self, key: str, item) -> None:
+        items = self.items.get(key)
+
+        if items is None:
+            self.items[key] = {item}
+            self.size += 1
+
+            for deletion in self._deletions(key, self.max_distance):
+                keys = self.deletions.get(deletion)
+                if keys is None:
+                    self.deletions[deletion] = key
+                elif isinstance(keys, list):
+                    keys.append(key)
+                else:
+                    self.deletions[deletion] = [keys, key]
+            return
+
+        if item not in items:
+            items.add(item)
+            self.size += 1
+
+    def remove(self, key: str, item) -> None:
+        items = self.items.get(key)
+        if items is None or item not in items:
+            return
+
+        items.discard(item)
+        self.size -= 1
+        if items:
+            return
+
+        del self.items[key]
+        for deletion in self._deletions(key, self.max_distance):
+            keys = self.deletions.get(deletion)
+            if keys == key:
+                del self.deletions[deletion]
+            elif isinstance(keys, list):
+                keys.remove(key)
+                if len(keys) == 1:
+                    self.deletions[deletion] = keys[0]
+
+    # (distance, item) of the keys within tolerance (at most max_distance) from key, the closest first
+    def search(self, key: str, tolerance: int) -> list:
+        if tolerance > self.max_distance:
+            raise ValueError(f"The index finds words within {self.max_distance} typos, not {tolerance}")
+
+        candidates = set()
+        for deletion in self._deletions(key, tolerance):
+            keys = self.deletions.get(deletion)
+            if isinstance(keys, list):
+                candidates.update(keys)
+            elif keys is not None:
+                candidates.add(keys)
+
+        found = []
+        matcher = DistanceMatcher(key)
+
+        for candidate in candidates:
+            distance = matcher.distance(candidate, tolerance)
+            if distance <= tolerance:
+                found.extend((distance, item) for item in self.items[candidate])
+
+        return sorted(found, key=lambda pair: (pair[0], str(pair[1])))
+
+
+# Inverted index key -> set of items with a sorted key list for prefix lookups.
+# query() understands "a AND b NOT c OR d": AND binds stronger than OR, neighbouring terms mean AND,
+# a term that ends with "*" matches every key with that prefix.
+class InvertedIndex:
+    def __init__(self) -> None:
+        self.postings = {}
+        self.sorted_keys = []
+
+    def __len__(self) -> int:
+        return len(self.postings)
+
+    def add(self, key: str, item) -> None:
+        items = self.postings.get(key)
+
+        if items is None:
+            self.postings[key] = items = set()
+            insort(self.sorted_keys, key)
+
+        items.add(item)
+
+    def remove(self, key: str, item) -> None:
+        items = self.postings.get(key)
+
+        if items is None:
+            return
+
+        items.discard(item)
+
+        if not items:
+            del self.postings[key]
+            del self.sorted_keys[bisect_left(self.sorted_keys, key)]
+
+    def get(self, key: str) -> set:
+        return self.postings.get(key, set())
+
+    def keys_with_prefix(self, prefix: str) -> list:
+        start = bisect_left(self.sorted_keys, prefix)
+        keys = []
+
+        for key in self.sorted_keys[start:]:
+            if not key.startswith(prefix):
+                break
+            keys.append(key)
+
+        return keys
+
+    def frequencies(self, prefix: str = "") -> list:
+        keys = self.keys_with_prefix(prefix) if prefix else self.sorted_keys
+        return sorted(
+            ((key, len(self.postings[key])) for key in keys),
+            key=lambda pair: (-pair[1], pair[0]),
+        )
+
+    def _term(self, term: str) -> set:
+        if term.endswith("*"):
+            keys = self.keys_with_prefix(term[:-1])
+            if len(keys) == 1:
+                return self.postings[keys[0]]
+            return set().union(*(self.postings[key] for key in keys))
+
+        return self.get(term)
+
+    def query(self, expression: str, every_item=None) -> set:
+        result = set()
+
+        for group in _split_query(expression):
+            included = [self._term(term) for term in group["and"]]
+            excluded = [self._term(term) for term in group["not"]]
+
+            if included:
+                # the smallest posting list goes first, every next intersection can only shrink it
+                included.sort(key=len)
+                matched = set(included[0])
+                for items in included[1:]:
+                    if not matched:
+                        break
+                    matched &= items
+            elif every_item is not None:
+                # "NOT c" on its own means everything except c
+                matched = set(every_item)
+            else:
+                matched = set()
+
+            for items in excluded:
+                matched -= items
+
+            result |= matched
+
+        return result
+
+
+def _split_query(expression: str) -> list:
+    groups = [{"and": [], "not": []}]
+    negate = False
+
+    for token in expression.split():
+        operator = token.upper()
+
+        if operator == "OR":
+            groups.append({"and": [], "not": []})
+            negate = False
+        elif operator == "AND":
+            continue
+        elif operator == "NOT":
+            negate = True
+        else:
+            groups[-1]["not" if negate else "and"].append(token.casefold())
+            negate = False
+
+    return [group for group in groups if group["and"] or group["not"]]
+
+
+# Ordered (key, item) pairs for listings by name. The pairs are kept in sorted blocks of a few hundred
+# (like a B-tree with two levels), so an insert or a delete moves one small block instead of the whole
+# list, and a page is one bisect plus a slice however big the index is.
+class SortedIndex:
+    BLOCK_SIZE = 512
+
+    def __init__(self) -> None:
+        self.blocks = []
+        # the last pair of every block, what bisect looks for the right block in
+        self.maxes = []
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def clear(self) -> None:
+        self.blocks.clear()
+        self.maxes.clear()
+        self.size = 0
+
+    def add(self, key: str, item) -> None:
+        pair = (key, item)
+
+        if not self.blocks:
+            self.blocks.append([pair])
+            self.maxes.append(pair)
+            self.size += 1
+            return
+
+        position = bisect_left(self.maxes, pair)
+        if position == len(self.maxes):
+            position -= 1
+            self.blocks[position].append(pair)
+            self.maxes[position] = pair
+        else:
+            insort(self.blocks[position], pair)
+        self.size += 1
+
+        block = self.blocks[position]
+        if len(block) > 2 * self.BLOCK_SIZE:
+            self.blocks[position:position + 1] = [block[:self.BLOCK_SIZE], block[self.BLOCK_SIZE:]]
+            self.maxes[position:position + 1] = [block[self.BLOCK_SIZE - 1], block[-1]]
+
+    def remove(self, key: str, item) -> None:
+        pair = (key, item)
+        position = bisect_left(self.maxes, pair)
+        if position == len(self.maxes):
+            return
+
+        block = self.blocks[position]
+        index = bisect_left(block, pair)
+        if index == len(block) or block[index] != pair:
+            return
+
+        del block[index]
+        self.size -= 1
+
+        if block:
+            self.maxes[position] = block[-1]
+        else:
+            del self.blocks[position]
+            del self.maxes[position]
+
+    # pairs from the first one with key >= start, or strictly after the cursor pair of the previous page
+    def pairs_from(self, start: str = "", after: tuple = None):
+        if after is not None:
+            position = bisect_right(self.maxes, after)
+            find = bisect_right
+            bound = after
+        else:
+            position = bisect_left(self.maxes, (start,))
+            find = bisect_left
+            bound = (start,)
+
+        if position == len(self.blocks):
+            return
+
+        block = self.blocks[position]
+        yield from block[find(block, bound):]
+        for index in range(position + 1, len(self.blocks)):
+            yield from self.blocks[index]
+
+    # One page of at most size pairs and the cursor for the next one (None on the last page).
+    # The cursor is the last pair itself, so inserts and deletes between the pages never shift them.
+    def page(self, size: int, start: str = "", after: tuple = None, prefix: str = "") -> tuple:
+        pairs = []
+
+        for pair in self.pairs_from(max(start, prefix), after):
+            if not pair[0].startswith(prefix):
+                return pairs, None
+            if len(pairs) == size:
+                return pairs, pairs[-1]
+            pairs.append(pair)
+
+        return pairs, None
+
+    # number of pairs before the bound: whole blocks are counted by their length, one block is bisected
+    def _rank(self, bound: tuple) -> int:
+        position = bisect_left(self.maxes, bound)
+        rank = sum(len(block) for block in self.blocks[:position])
+        if position < len(self.blocks):
+            rank += bisect_left(self.blocks[position], bound)
+        return rank
+
+    def count_with_prefix(self, prefix: str) -> int:
+        if not prefix:
+            return self.size
+        return self._rank((prefix + "\U0010ffff",)) - self._rank((prefix,))
+
+    def pairs_with_prefix(self, prefix: str, limit: int = None) -> list:
+        return list(islice(takewhile(lambda pair: pair[0].startswith(prefix), self.pairs_from(prefix)), limit))
@@ -0,0 +1,80 @@
+# Sidecar cache of what a book builds from its save file: records that are already validated and their indexes,
+# pickled together with the size, mtime and hash of the file they were built from. While the file stays
+# the same a launch unpickles that state instead of parsing, validating and indexing everything again.
+# The state is plain data (dicts, lists, strings and the index objects), never classes of the books themselves:
+# those live in __main__ when a book runs as a script, and unpickling them would import the book a second time.
+import gc
+import hashlib
+import os
+import pickle
+
+CACHE_SUFFIX = ".cache"
+# bump when the pickled state changes its shape, caches of the old shape are then simply rebuilt
+CACHE_VERSION = 3
+HASH_BUFFER_SIZE = 1024 * 1024
+
+
+def cache_path(filename: str) -> str:
+    return filename + CACHE_SUFFIX
+
+
+def file_hash(filename: str) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_BUFFER_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# The state saved for filename, or None when there is no cache or it was built from another version of the file.
+# The header (version, size, mtime, hash) is a pickle of its own, so a stale cache is rejected without
+# reading the state; the hash is only computed when the size matches but the mtime does not.
+# build(state) makes the book's objects out of the state, it runs without the collector too.
+def load_cache(filename: str, build=None):
+    try:
+        with open(cache_path(filename), "rb") as file:
+            version, size, mtime, digest = pickle.load(file)
+            if version != CACHE_VERSION:
+                return None
+
+            stat = os.stat(filename)
+            if stat.st_size != size:
+                return None
+            if stat.st_mtime_ns != mtime and file_hash(filename) != digest:
+                return None
+
+            # the collector would otherwise run over and over while millions of objects appear, which makes
+            # loading several times slower; nothing made here is garbage yet
+            was_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                state = pickle.load(file)
+                return build(state) if build is not None else state
+            finally:
+                if was_enabled:
+                    gc.enable()
+    # a missing, broken or outdated cache is not an error, the state is built from the file as before
+    except Exception:
+        return None
+
+
+# Saves the state built from filename as it is on the disk right now, the caller makes sure nobody writes it meanwhile
+def save_cache(filename: str, state) -> None:
+    path = cache_path(filename)
+
+    try:
+        stat = os.stat(filename)
+        header = (CACHE_VERSION, stat.st_size, stat.st_mtime_ns, file_hash(filename))
+
+        # write to a temporary file first, like the save files themselves
+        with open(path + ".tmp", "wb") as file:
+            pickle.dump(header, file, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(state, file, pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    # the cache only speeds up the next launch, failing to write it must not break a save
+    except (OSError, pickle.PicklingError, RecursionError):
+        try:
+            os.remove(path + ".tmp")
+        except OSError:
+            pass
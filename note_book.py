@@ -10,8 +10,17 @@ from interface import (
     ConsoleUserInput,
     ABCRecord,
 )
+from autosave import AutoSaver
+from completion import Completer, set_completer
+from command_log import CommandLog
+from contextlib import nullcontext
+from indexes import InvertedIndex, SortedIndex
+from load_cache import load_cache, save_cache
+from note_storage import BlobStore, apply_delta, make_delta
+from datetime import datetime
 from typing import Union
 import logging
+import threading
 
 logger = logging.getLogger("Note Debugger")
 logger.setLevel(logging.DEBUG)
@@ -31,26 +40,69 @@ logger.addHandler(fh)
 # LOW ENTITY CLASSES
 # Клас Note представляє окрему нотатку з такими атрибутами:
 # title: Рядок, що представляє заголовок нотатки.
-# content: Рядок, що містить вміст нотатки.
+# content: Рядок, що містить вміст нотатки (збережений вміст щоразу читається зі сховища, у пам'яті лише незбережений).
 # tags: Список рядків, які представляють теги, пов'язані з нотаткою.
+# blob: Назва файлу зі вмістом у BlobStore (None, поки нотатку не збережено).
+# history: Список ревізій, кожна зберігає зворотну дельту до попередньої версії вмісту.
 class Note(ABCRecord):
-    def __init__(self, title, content, tags=[]) -> None:
+    def __init__(self, title, content, tags=[], blob=None, store=None) -> None:
         self.title = title
-        self.content = content
         self.tags = tags if tags is not None else []
+        self.blob = blob
+        self.store = store
+        # only content that is not in the store yet; None - it is read from the store every time,
+        # so memory does not grow with the text of all notes (the store keeps a few recent ones)
+        self._content = content
+        self.is_dirty = content is not None
+        self._history = None if blob else []
+        self.is_history_dirty = False
+
+    @property
+    def content(self) -> str:
+        if self._content is None:
+            return self.store.read(self.blob)
+        return self._content
+
+    @content.setter
+    def content(self, new_content: str) -> None:
+        self._content = new_content
+        self.is_dirty = True
+
+    @property
+    def history(self) -> list:
+        if self._history is None:
+            self._history = self.store.read_history(self.blob)
+        return self._history
 
     def __str__(self) -> str:
         return f"Title: {self.title}\nContent: {self.content}\nTags: {', '.join(self.tags)}"
 
 
 # Клас Notebook представляє собою колекцію нотаток і надає методи для їх управління. Він має наступні атрибути:
-# notes: Список об'єктів Note.
-# filename: Назва файлу, який використовується для зберігання нотаток у форматі JSON.
+# notes: Список об'єктів Note (будується з title_index).
+# title_index: Словник заголовок (casefold) -> Note, зберігає порядок додавання нотаток.
+# tag_index: Індекс тег (casefold) -> множина заголовків (casefold) нотаток з цим тегом.
+# sorted_titles: Заголовки в алфавітному порядку (casefold, заголовок) для автодоповнення.
+# filename: Назва файлу, який використовується для зберігання заголовків і тегів нотаток у форматі JSON.
+# store: Сховище вмісту нотаток (окремий, за можливості стиснутий, файл на кожну нотатку).
 class Notebook:
-    def __init__(self, filename: str = "notes.json") -> None:
-        self.notes = []
+    def __init__(self, filename: str = "notes.json", compress: bool = True) -> None:
+        self.title_index = {}
+        self.tag_index = InvertedIndex()
+        self.sorted_titles = SortedIndex()
         self.filename = filename
+        self.store = BlobStore(os.path.splitext(filename)[0] + "_content", compress)
+        # blobs of deleted notes, removed from the disk with the next save
+        self.deleted_blobs = []
+        # old files of blobs rewritten with the other extension (.txt <-> .z), removed after notes.json is written
+        self.replaced_blobs = []
+        # undo/redo of the commands that changed the notebook
+        self.command_log = CommandLog(self)
         self.is_finished = False
+        # held by the input loop while a command runs and by the autosave worker while it copies the notes
+        self.lock = threading.RLock()
+        # held while notes.json is written, the autosave writes it without the notebook lock
+        self.save_lock = threading.Lock()
 
         if not os.path.exists(self.filename):
             with open(self.filename, "w") as file:
@@ -58,6 +110,33 @@ class Notebook:
         else:
             self.load_notes()
 
+    @property
+    def notes(self) -> list:
+        return list(self.title_index.values())
+
+    @notes.setter
+    def notes(self, notes: list) -> None:
+        self.title_index = {}
+        self.tag_index = InvertedIndex()
+        # той самий об'єкт, на нього посилається автодоповнення
+        self.sorted_titles.clear()
+        for note in notes:
+            title = note.title.casefold()
+            if title not in self.title_index:
+                self.title_index[title] = note
+                self.sorted_titles.add(title, note.title)
+                self._index_tags(note, note.tags)
+
+    def _index_tags(self, note: Note, tags: list) -> None:
+        title = note.title.casefold()
+        for tag in tags:
+            self.tag_index.add(tag.casefold(), title)
+
+    def _unindex_tags(self, note: Note) -> None:
+        title = note.title.casefold()
+        for tag in note.tags:
+            self.tag_index.remove(tag.casefold(), title)
+
     def add_note(
         self, note: Note
     ) -> (
@@ -68,14 +147,30 @@ class Notebook:
 
         # Перевірка на однакові назви
         title = note.title.casefold()
-        for existing_note in self.notes:
-            if existing_note.title.casefold() == title:
-                logger.debug("Note with the same title already exists.")
-                return
+        if title in self.title_index:
+            logger.debug("Note with the same title already exists.")
+            return
 
-        self.notes.append(note)
+        self.title_index[title] = note
+        self.sorted_titles.add(title, note.title)
+        self._index_tags(note, note.tags)
         logger.debug("Note added!")
 
+    def add_tags(self, note: Note, tags: list) -> bool:  # Додає теги до нотатки, якщо жодного з них ще немає.
+        existing_tags = {tag.casefold() for tag in note.tags}
+        if any(tag.casefold() in existing_tags for tag in tags):
+            return False
+
+        note.tags.extend(tags)
+        self._index_tags(note, tags)
+        return True
+
+    def query_tags(
+        self, expression: str
+    ) -> list:  # Нотатки за виразом з тегів: "a AND b NOT c", "a OR b", "ma*".
+        titles = self.tag_index.query(expression, every_item=self.title_index)
+        return [self.title_index[title] for title in sorted(titles)]
+
     def find_notes(
         self, keyword: str
     ) -> (
@@ -83,12 +178,13 @@ class Notebook:
     ):  # Шукає нотатки, які містять вказане ключове слово в їхніх заголовках, вмісті або тегах.
         """Пошук нотаток за ключовим словом."""
         keyword = keyword.lower()
+        tagged_titles = self.tag_index.get(keyword.casefold())
         matching_notes = []
-        for note in self.notes:
+        for title, note in self.title_index.items():
             if (
-                keyword in note.title.lower()
+                title in tagged_titles
+                or keyword in note.title.lower()
                 or keyword in note.content.lower()
-                or keyword in note.tags
             ):
                 matching_notes.append(note)
         return matching_notes
@@ -96,11 +192,7 @@ class Notebook:
     def find_note(
         self, title: str
     ) -> Union[Note, None]:  # Знаходить нотатку за її заголовком.
-        title = title.casefold()
-        for note in self.notes:
-            if note.title.casefold() == title:
-                return note
-        return None
+        return self.title_index.get(title.casefold())
 
     def edit_note(self, title: str) -> bool:  # Редагує вміст існуючої нотатки.
         note = self.find_note(title)
@@ -120,40 +212,203 @@ class Notebook:
         except WrongArgumentFormat as error:
             logger.debug(error)
         else:
-            note.content = new_content
+            self.update_content(note, new_content)
             return True
 
+    def update_content(
+        self, note: Note, new_content: str
+    ) -> None:  # Змінює вміст нотатки і додає ревізію з дельтою до попереднього вмісту.
+        note.history.append(
+            {
+                "time": datetime.now().isoformat(sep=" ", timespec="seconds"),
+                "delta": make_delta(new_content, note.content),
+            }
+        )
+        note.content = new_content
+        note.is_history_dirty = True
+
+    def content_at(
+        self, note: Note, revision: int
+    ) -> str:  # Відновлює вміст ревізії: 0 - перша версія, len(history) - поточна.
+        text = note.content
+        for entry in reversed(note.history[revision:]):
+            text = apply_delta(text, entry["delta"])
+        return text
+
     def _delete_record(self, title: str) -> bool:  #  Видаляє нотатку за заголовком.
-        title = title.casefold()
-        for note in self.notes.copy():
-            if note.title.casefold() == title.casefold():
-                self.notes.remove(note)
-                return True
-        return False
+        note = self.title_index.pop(title.casefold(), None)
+        if note is None:
+            return False
+
+        self.sorted_titles.remove(note.title.casefold(), note.title)
+        self._unindex_tags(note)
+        if note.blob:
+            # історія читається до того, як збереження видалить файли: undo має повернути нотатку разом з нею
+            if note._history is None:
+                note._history = self.store.read_history(note.blob)
+            self.deleted_blobs.append(note.blob)
+        return True
+
+    def snapshot(
+        self, title: str
+    ) -> Union[tuple, None]:  # Стан нотатки для журналу undo: (нотатка, вміст, теги, кількість ревізій, остання ревізія).
+        note = self.find_note(title)
+        if note is None:
+            return None
+        history = note.history
+        return note, note.content, list(note.tags), len(history), history[-1] if history else None
+
+    def restore(
+        self, title: str, state: Union[tuple, None]
+    ) -> None:  # Повертає нотатку до стану зі snapshot (той самий об'єкт, разом з історією).
+        current = self.find_note(title)
+
+        if state is None:
+            if current is not None:
+                self._delete_record(title)
+            return
+
+        note, content, tags, revisions, last_revision = state
+
+        if current is not note:
+            if current is not None:
+                self._delete_record(title)
+            self.title_index[note.title.casefold()] = note
+            self.sorted_titles.add(note.title.casefold(), note.title)
+            self._index_tags(note, note.tags)
+            if note.blob in self.deleted_blobs:
+                self.deleted_blobs.remove(note.blob)
+            elif note.blob:
+                # збереження вже видалило її файли: вміст (зі snapshot) та історія пишуться знову
+                note._content = content
+                note.is_dirty = True
+                note.is_history_dirty = True
+
+        # undo/redo не є новою правкою: ревізія правки знімається або повертається, а не додається ще одна
+        history = note.history
+        if len(history) > revisions or len(history) == revisions - 1:
+            if len(history) > revisions:
+                del history[revisions:]
+            else:
+                history.append(last_revision)
+            note.is_history_dirty = True
+            if note.content != content:
+                note.content = content
+        elif note.content != content:
+            self.update_content(note, content)
+
+        if note.tags != tags:
+            self._unindex_tags(note)
+            note.tags = list(tags)
+            self._index_tags(note, note.tags)
 
     def list_notes(self) -> None:  # Перелічує всі нотатки у блокноті.
-        if not self.notes:
+        if not self.title_index:
             logger.debug("No notes available.")
         else:
-            for i, note in enumerate(self.notes, start=1):
+            for i, note in enumerate(self.title_index.values(), start=1):
                 logger.debug(f"{i}. Title: {note.title}")
                 logger.debug(f"   Content: {note.content}")
                 logger.debug(f"   Tags: {', '.join(note.tags)}")
 
-    def save_notes(self) -> None:  # Зберігає нотатки у JSON-файлі.
-        data = [
-            {"title": note.title, "content": note.content, "tags": note.tags}
-            for note in self.notes
-        ]
-        with open(self.filename, "w") as file:
-            json.dump(data, file)
+    def save_notes(
+        self,
+    ) -> None:  # Зберігає заголовки і теги у JSON-файлі, а у сховище записує лише змінений вміст.
+        with self.lock, self.save_lock:
+            self._write_notes(*self._collect_notes())
+            save_cache(self.filename, self._cached_state())
+
+    def autosave_notes(
+        self,
+    ) -> None:  # Фонове збереження: блокнот заблокований лише поки пишеться змінений вміст і копіюється список.
+        with self.lock:
+            collected = self._collect_notes()
+            # береться до звільнення блокнота, щоб пізніше збереження не випередило це
+            self.save_lock.acquire()
+
+        try:
+            self._write_notes(*collected)
+        finally:
+            self.save_lock.release()
+
+    def _collect_notes(self) -> tuple:  # Записує змінений вміст у сховище, повертає (дані для JSON, видалені blob, замінені blob).
+        data = []
+        for note in self.title_index.values():
+            if note.is_dirty:
+                new_blob = self.store.write(note.blob, note.content)
+                if note.blob and note.blob != new_blob:
+                    self.replaced_blobs.append(note.blob)
+                note.blob = new_blob
+                note.store = self.store
+                note._content = None
+                note.is_dirty = False
+            if note.is_history_dirty:
+                self.store.write_history(note.blob, note.history)
+                note._history = None
+                note.is_history_dirty = False
+            data.append({"title": note.title, "tags": list(note.tags), "blob": note.blob})
+
+        deleted_blobs, self.deleted_blobs = self.deleted_blobs, []
+        replaced_blobs, self.replaced_blobs = self.replaced_blobs, []
+        return data, deleted_blobs, replaced_blobs
+
+    def _write_notes(self, data: list, deleted_blobs: list, replaced_blobs: list) -> None:
+        try:
+            # write to a temporary file first, so an interrupted background save never leaves a broken file
+            with open(self.filename + ".tmp", "w") as file:
+                json.dump(data, file)
+            os.replace(self.filename + ".tmp", self.filename)
+        except OSError:
+            # notes.json still refers to the old files, they are removed after the next save that succeeds
+            self.deleted_blobs.extend(deleted_blobs)
+            self.replaced_blobs.extend(replaced_blobs)
+            raise
+
+        # only now nothing refers to the old files
+        for blob in deleted_blobs:
+            self.store.delete(blob)
+        for blob in replaced_blobs:
+            self.store.delete_content(blob)
+
+    def _cached_state(self) -> dict:  # Усе, що load_notes будує з файлу, для кешу завантаження.
+        # нотатки як прості дані (заголовок, незбережений вміст, теги, blob): Note з pickle тягнув би за собою
+        # модуль note_book (або __main__, коли блокнот запущено як скрипт)
+        notes = [(note.title, note._content, list(note.tags), note.blob) for note in self.title_index.values()]
+        return {"notes": notes, "tag_index": self.tag_index, "sorted_titles": self.sorted_titles}
+
+    def _from_cached_state(self, state: dict) -> dict:  # Будує нотатки й індекси зі стану з кешу.
+        self.title_index = {
+            title.casefold(): Note(title, content, tags, blob, self.store)
+            for title, content, tags, blob in state["notes"]
+        }
+        self.tag_index = state["tag_index"]
+        # той самий об'єкт, на нього посилається автодоповнення
+        self.sorted_titles.clear()
+        for title, note_title in state["sorted_titles"].pairs_from():
+            self.sorted_titles.add(title, note_title)
+        return state
+
+    def load_notes(
+        self,
+    ) -> None:  # Завантажує заголовки і теги з JSON-файлу, вміст читається зі сховища за потреби.
+        self.deleted_blobs = []
+        # файл може ще посилатися на старі blob, їх не можна видаляти
+        self.replaced_blobs = []
+
+        # поки файл не змінився, нотатки й індекси беруться з кешу
+        if load_cache(self.filename, self._from_cached_state) is not None:
+            return
 
-    def load_notes(self) -> None:  # Завантажує нотатки з JSON-файлу.
         with open(self.filename, "r") as file:
             data = json.load(file)
+            # old files keep the content inline, such notes are moved to the store with the next save
             self.notes = [
-                Note(note["title"], note["content"], note["tags"]) for note in data
+                Note(note["title"], note["content"], note["tags"])
+                if "content" in note
+                else Note(note["title"], None, note["tags"], note["blob"], self.store)
+                for note in data
             ]
+        save_cache(self.filename, self._cached_state())
 
 
 # Interface Classes
@@ -179,12 +434,23 @@ class NoteBookConsoleUI(ConsoleUI):
             "sort": output_interface._sort_notes_by_tags,
             "list": output_interface._show_all_items,
             "find": output_interface._find,
+            "tags": output_interface._find_by_tags,
+            "tag stats": output_interface._show_tag_stats,
+            "history": output_interface._show_history,
+            "revert": manager_interface._revert,
+            "undo": manager_interface._undo,
+            "redo": manager_interface._redo,
             "reset": manager_interface._reset,
             "save": manager_interface._save,
             "exit": manager_interface._finish,
             "help": menu_interface.show_menu,
         }
 
+        # commands that change the note named in their first argument, they go to the undo log
+        self.mutating_commands = {"add", "edit", "delete", "add tag", "revert"}
+        # commands that take a note title first, Tab completes the title after them
+        self.name_commands = {"edit", "delete", "add tag", "revert", "history"}
+
     # Universal command performer/handler
     @exception_catcher_decorator
     def perform_command(self, command: str, notebook, *args, **kwargs) -> None:
@@ -216,6 +482,49 @@ class NoteBookInformationOutput(InformationOutputManager):
         else:
             logger.debug("No notes found.")
 
+    @exception_catcher_decorator
+    def _find_by_tags(self, notebook: Notebook, line_list: list) -> None:
+        # Пошук нотаток за виразом з тегів.
+        expression = " ".join(line_list[1:])
+        if not expression:
+            raise IndexError
+
+        matching_notes = notebook.query_tags(expression)
+        if matching_notes:
+            logger.debug(f"Found {len(matching_notes)} note(s):")
+            for note in matching_notes:
+                logger.debug(note)
+        else:
+            logger.debug("No notes found.")
+
+    @exception_catcher_decorator
+    def _show_tag_stats(self, notebook: Notebook, line_list: list) -> None:
+        # Теги за частотою використання.
+        prefix = line_list[1].casefold() if len(line_list) > 1 else ""
+        frequencies = notebook.tag_index.frequencies(prefix)
+        if not frequencies:
+            logger.debug("No tags found.")
+        for tag, count in frequencies:
+            logger.debug(f"{tag} - {count}")
+
+    @exception_catcher_decorator
+    def _show_history(self, notebook: Notebook, line_list: list, *_) -> None:
+        # Ревізії нотатки.
+        note = notebook.find_note(line_list[1])
+        if note is None:
+            logger.debug("Note not found!")
+            return
+
+        logger.debug(f"Revisions of {note.title}:")
+        logger.debug("0 - the first version")
+        for revision, entry in enumerate(note.history, start=1):
+            changed = sum(
+                max(end - start, len(replacement))
+                for start, end, replacement in entry["delta"]
+            )
+            logger.debug(f"{revision} - {entry['time']}, {changed} symbol(s) changed")
+        logger.debug(f"Current revision: {len(note.history)}")
+
     @exception_catcher_decorator
     def _hello(self, *_) -> None:
         logger.debug("How can I help you?")
@@ -271,11 +580,10 @@ class NoteBookManager(Manager):
                 logger.debug("Invalid format. Tags can't be empty.")
 
             elif all(len(tag) < 20 for tag in new_tags):
-                if any(tag.casefold() in note.tags for tag in new_tags):
-                    logger.debug("Some tags already exist for this note.")
-                else:
-                    note.tags.extend(new_tags)
+                if notebook.add_tags(note, new_tags):
                     logger.debug("Tags added!")
+                else:
+                    logger.debug("Some tags already exist for this note.")
 
             else:
                 logger.debug("Invalid format. Tags <= 20.")
@@ -325,15 +633,52 @@ class NoteBookManager(Manager):
 
     def _close_without_saving(self, notebook, *_) -> None:
         notebook.is_finished = True
-        logger.debug("Will NOT save! BB!")
+        logger.debug("Will NOT save the changes since the last autosave! BB!")
 
     def _finish(self, notebook, *_) -> None:
         notebook.is_finished = True
         logger.debug("Good bye!")
 
+    @exception_catcher_decorator
+    def _revert(self, notebook: Notebook, line_list: list, *_) -> None:
+        # Повернути вміст нотатки до ревізії (саме повернення теж стає ревізією).
+        note = notebook.find_note(line_list[1])
+        if note is None:
+            logger.debug("Note not found!")
+            return
+
+        try:
+            revision = int(line_list[2])
+        except ValueError:
+            logger.debug("Revision should be a number!")
+            raise WrongArgumentFormat
+
+        if not 0 <= revision <= len(note.history):
+            logger.debug(f"No such revision! Available: 0-{len(note.history)}.")
+        elif revision == len(note.history):
+            logger.debug("It is the current revision already.")
+        else:
+            notebook.update_content(note, notebook.content_at(note, revision))
+            logger.debug(f"Note {note.title} reverted to revision {revision}!")
+
+    def _undo(self, notebook: Notebook, *_) -> None:
+        operation = notebook.command_log.undo()
+        if operation:
+            logger.debug(f"Undone: {operation.description}")
+        else:
+            logger.debug("Nothing to undo!")
+
+    def _redo(self, notebook: Notebook, *_) -> None:
+        operation = notebook.command_log.redo()
+        if operation:
+            logger.debug(f"Redone: {operation.description}")
+        else:
+            logger.debug("Nothing to redo!")
+
     def _reset(self, notebook, *_) -> None:
         notebook.load_notes()
-        logger.debug("Notes loaded from the file as it was before the start.")
+        notebook.command_log.clear()
+        logger.debug("Notes loaded from the file as it was at the last save or autosave.")
 
     def _save(self, notebook: Notebook, *_) -> None:
         # Зберегти нотатки у файл.
@@ -353,9 +698,15 @@ class NoteBookMenu(Menu):
             "sort": "Sort Notes (Сортування)",
             "list": "List Notes (Вивести список)",
             "find": "Find Notes(Пошук)",
-            "reset": "Reset Session (Збросити зміни)",
+            "tags": "Find Notes by tags, e.g. 'tags milk AND cow NOT sea', 'tags ma*' (Пошук за тегами)",
+            "tag stats": "Show tags by frequency, optionally only with a prefix (Статистика тегів)",
+            "history": "Show revisions of a Note (Історія змін)",
+            "revert": "Bring back a revision of a Note: revert <title> <revision> (Повернути ревізію)",
+            "undo": "Undo the last change (Скасувати)",
+            "redo": "Redo the last undone change (Повторити)",
+            "reset": "Drop the changes since the last save or autosave (Збросити зміни)",
             "save": "Save Notes (Зберігання)",
-            "exit": "Exit (Вихід без зберігання)",
+            "exit": "Exit without saving the changes since the last autosave (Вихід)",
         }
 
     def show_menu(self, *_) -> None:
@@ -375,6 +726,12 @@ def main() -> None:
     )
 
     notebook = Notebook()
+    autosaver = AutoSaver(notebook.autosave_notes)
+    autosaver.start()
+    notebook.command_log.listeners.append(lambda titles: autosaver.notify())
+    previous_completer = set_completer(
+        Completer(ui.command_list, notebook.sorted_titles, ui.name_commands)
+    )
 
     logger.debug("*" * 10)
     ui.output_interface._hello()
@@ -386,10 +743,20 @@ def main() -> None:
         user_input = ui.get_user_input()
         line_list = parse_command(user_input, ui.command_list)
         current_command = line_list[0].casefold()
-        ui.perform_command(current_command, notebook, line_list)
+
+        with notebook.lock:
+            if current_command in ui.mutating_commands:
+                tracker = notebook.command_log.track(user_input, line_list[1:2])
+            else:
+                tracker = nullcontext()
+
+            with tracker:
+                ui.perform_command(current_command, notebook, line_list)
 
         # checker to return to jason.py, bcz decorator over 'perform_command' returns None and makes it tricky
         if notebook.is_finished:
+            autosaver.stop()
+            set_completer(previous_completer)
             break
 
 
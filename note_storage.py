@@ -0,0 +1,146 @@
+from difflib import SequenceMatcher
+from collections import OrderedDict
+import json
+import os
+import uuid
+import zlib
+
+
+# above this many compared symbol pairs the changed middle is stored as one splice instead of a fine diff
+DIFF_MAX_WORK = 250_000
+# texts of this many recently read or written blobs are kept in memory
+BLOB_CACHE_SIZE = 64
+
+
+# Reverse delta: the list of [start, end, text] splices that turn the new text back into the old one.
+# Only the changed parts are stored, so a revision costs as much as the edit, not as the whole note.
+def make_delta(new_text: str, old_text: str) -> list:
+    # a typical edit touches one place, the unchanged head and tail are cut off before diffing
+    head = _common_prefix_length(new_text, old_text)
+    tail_limit = min(len(new_text), len(old_text)) - head
+    tail = _common_prefix_length(new_text[::-1][:tail_limit], old_text[::-1][:tail_limit])
+    new_middle = new_text[head : len(new_text) - tail]
+    old_middle = old_text[head : len(old_text) - tail]
+
+    if not new_middle and not old_middle:
+        return []
+
+    if len(new_middle) * len(old_middle) > DIFF_MAX_WORK:
+        return [[head, head + len(new_middle), old_middle]]
+
+    matcher = SequenceMatcher(None, new_middle, old_middle, autojunk=False)
+    return [
+        [head + new_start, head + new_end, old_middle[old_start:old_end]]
+        for tag, new_start, new_end, old_start, old_end in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+
+
+# binary search over slice comparisons, the comparisons themselves run in C
+def _common_prefix_length(first: str, second: str) -> int:
+    low, high = 0, min(len(first), len(second))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if first[:middle] == second[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def apply_delta(text: str, delta: list) -> str:
+    # splices go from the end, so the positions of the earlier ones stay valid
+    for start, end, replacement in reversed(delta):
+        text = text[:start] + replacement + text[end:]
+    return text
+
+
+# Folder with one file per note content. A blob is stored zlib-compressed ("<id>.z") when that is
+# smaller, otherwise as plain text ("<id>.txt"); the file name is the blob reference kept in notes.json.
+# The last few texts are kept in a small LRU, all the others are read from the disk when asked for.
+class BlobStore:
+    def __init__(self, folder: str, compress: bool = True, cache_size: int = BLOB_CACHE_SIZE) -> None:
+        self.folder = folder
+        self.compress = compress
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def _path(self, blob: str) -> str:
+        return os.path.join(self.folder, blob)
+
+    def _remember(self, blob: str, text: str) -> None:
+        self._cache[blob] = text
+        self._cache.move_to_end(blob)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def read(self, blob: str) -> str:
+        text = self._cache.get(blob)
+        if text is not None:
+            self._cache.move_to_end(blob)
+            return text
+
+        with open(self._path(blob), "rb") as file:
+            data = file.read()
+
+        if blob.endswith(".z"):
+            data = zlib.decompress(data)
+
+        text = data.decode("utf-8")
+        self._remember(blob, text)
+        return text
+
+    def write(self, blob: str, text: str) -> str:
+        os.makedirs(self.folder, exist_ok=True)
+        data = text.encode("utf-8")
+        blob_id = os.path.splitext(blob)[0] if blob else uuid.uuid4().hex
+        new_blob = blob_id + ".txt"
+
+        if self.compress:
+            packed = zlib.compress(data)
+            if len(packed) < len(data):
+                data = packed
+                new_blob = blob_id + ".z"
+
+        with open(self._path(new_blob) + ".tmp", "wb") as file:
+            file.write(data)
+        os.replace(self._path(new_blob) + ".tmp", self._path(new_blob))
+
+        # same id with the other extension: the old content file is left for the caller to delete with
+        # delete_content() once notes.json no longer refers to it
+        self._cache.pop(blob, None)
+        self._remember(new_blob, text)
+        return new_blob
+
+    def delete(self, blob: str) -> None:
+        self._cache.pop(blob, None)
+        for path in (self._path(blob), self._history_path(blob)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    # only the content file, the history of the same id stays (a blob that was rewritten with the other extension)
+    def delete_content(self, blob: str) -> None:
+        self._cache.pop(blob, None)
+        try:
+            os.remove(self._path(blob))
+        except FileNotFoundError:
+            pass
+
+    # revision history of a note lives next to its blob as compressed JSON: "<id>.hist"
+    def _history_path(self, blob: str) -> str:
+        return self._path(os.path.splitext(blob)[0] + ".hist")
+
+    def read_history(self, blob: str) -> list:
+        try:
+            with open(self._history_path(blob), "rb") as file:
+                return json.loads(zlib.decompress(file.read()).decode("utf-8"))
+        except FileNotFoundError:
+            return []
+
+    def write_history(self, blob: str, revisions: list) -> None:
+        path = self._history_path(blob)
+        with open(path + ".tmp", "wb") as file:
+            file.write(zlib.compress(json.dumps(revisions).encode("utf-8")))
+        os.replace(path + ".tmp", path)
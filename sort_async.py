@@ -0,0 +1,53 @@
+import asyncio, threading
+from pathlib import Path
+import file_sort
+from sort_progress import SortProgress
+
+# folders sorted at the same time by sort_folders()
+SORT_CONCURRENCY = 4
+
+
+# What sort_folder() gives back instead of printing.
+#   status: "done" or "failed" (error then says why); a cancelled sort raises CancelledError as usual
+#   report: SortProgress.to_dict() - counters, stage timings, skipped files and per-file errors
+class SortResult:
+    def __init__(self, folder: Path, status: str, report: dict = None, error: str = None) -> None:
+        self.folder = Path(folder)
+        self.status = status
+        self.report = report if report is not None else {}
+        self.error = error
+
+    def to_dict(self) -> dict:
+        return {"folder": str(self.folder), "status": self.status, "report": self.report, "error": self.error}
+
+
+# Sorts the folder in an executor thread, the event loop stays free. At most as many sorts run at once
+# as the semaphore allows. When the task is cancelled, the sort stops after the file it is moving now
+# (a thread can not be interrupted in the middle of a copy), saves the manifest and CancelledError goes on.
+async def sort_folder(path, use_manifest: bool = True, semaphore: asyncio.Semaphore = None,
+                      executor=None) -> SortResult:
+    folder = Path(path)
+    loop = asyncio.get_running_loop()
+    progress = SortProgress(show=False)
+    stop_event = threading.Event()
+    semaphore = semaphore if semaphore is not None else asyncio.Semaphore(1)
+
+    async with semaphore:
+        work = loop.run_in_executor(executor, file_sort.sort, folder, use_manifest, progress, stop_event)
+        try:
+            await asyncio.shield(work)
+        except asyncio.CancelledError:
+            stop_event.set()
+            await asyncio.wait([work])
+            raise
+        except OSError as error:
+            return SortResult(folder, "failed", progress.to_dict(), str(error))
+
+    return SortResult(folder, "done", progress.to_dict())
+
+
+# Sorts several folders from one event loop, results in the order of the folders
+async def sort_folders(paths: list, concurrency: int = SORT_CONCURRENCY, use_manifest: bool = True,
+                       executor=None) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*(sort_folder(path, use_manifest, semaphore, executor) for path in paths))
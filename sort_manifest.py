@@ -0,0 +1,100 @@
+import json, os
+from pathlib import Path
+import file_parser as parser
+
+MANIFEST_NAME = '.sort_manifest.jsonl'
+
+
+# Manifest of a sorted folder, kept inside it as JSON lines, newer lines win:
+#   {"folder": ..., "mtime": ..., "subfolders": [...]}  - a folder with nothing left to sort
+#   {"folder": ..., "mtime": null}                      - forget the folder
+# A run only appends its own lines, the file is rewritten when most of its lines are outdated.
+# Sorted files are not recorded: nothing needs them, and a line per file would only make every start slower.
+# Older manifests have such lines ({"path": ..., "destination": ...}), they are skipped and dropped with the next save.
+class SortManifest:
+    def __init__(self, folder: Path) -> None:
+        self.folder = Path(folder)
+        self.path = self.folder / MANIFEST_NAME
+        # folder -> (mtime_ns, subfolder names)
+        self.folders = {}
+        self._new_lines = []
+        self._line_count = 0
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, encoding='utf-8') as reader:
+                for line in reader:
+                    if line.strip():
+                        self._line_count += 1
+                        entry = json.loads(line)
+                        if 'folder' in entry:
+                            self._apply(entry)
+        except FileNotFoundError:
+            pass
+
+    def _apply(self, entry: dict) -> None:
+        if entry['mtime'] is None:
+            self.folders.pop(entry['folder'], None)
+        else:
+            self.folders[entry['folder']] = (entry['mtime'], entry['subfolders'])
+
+    def _add(self, entry: dict) -> None:
+        self._apply(entry)
+        self._new_lines.append(entry)
+
+    def _relative(self, path: Path) -> str:
+        return Path(path).relative_to(self.folder).as_posix()
+
+    # the folder was left with nothing to sort and nobody touched it since: no need to list it again
+    def is_unchanged(self, folder: Path) -> bool:
+        record = self.folders.get(self._relative(folder))
+        if record is None:
+            return False
+        try:
+            return os.stat(folder).st_mtime_ns == record[0]
+        except FileNotFoundError:
+            return False
+
+    def subfolders(self, folder: Path) -> list:
+        return [Path(folder) / name for name in self.folders[self._relative(folder)][1]]
+
+    def record_folder(self, folder: Path) -> None:
+        if self.is_unchanged(folder):
+            return
+
+        subfolders = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if entry.name not in parser.SORTED_FOLDERS:
+                        subfolders.append(entry.name)
+                elif entry.name != MANIFEST_NAME:
+                    # something is still waiting to be sorted here, the folder has to be listed next time
+                    self.forget_folder(folder)
+                    return
+        self._add({'folder': self._relative(folder), 'mtime': os.stat(folder).st_mtime_ns,
+                   'subfolders': sorted(subfolders)})
+
+    def forget_folder(self, folder: Path) -> None:
+        if self._relative(folder) in self.folders:
+            self._add({'folder': self._relative(folder), 'mtime': None})
+
+    def save(self) -> None:
+        is_outdated = self._line_count + len(self._new_lines) > 2 * len(self.folders) + 1000
+        if not self._new_lines and not is_outdated:
+            return
+
+        if is_outdated:
+            lines = [{'folder': folder, 'mtime': mtime, 'subfolders': subfolders}
+                     for folder, (mtime, subfolders) in self.folders.items()]
+            with open(str(self.path) + '.tmp', 'w', encoding='utf-8') as writer:
+                writer.writelines(json.dumps(line, ensure_ascii=False) + '\n' for line in lines)
+            os.replace(str(self.path) + '.tmp', self.path)
+            self._line_count = len(lines)
+        else:
+            with open(self.path, 'a', encoding='utf-8') as writer:
+                writer.writelines(json.dumps(line, ensure_ascii=False) + '\n' for line in self._new_lines)
+            self._line_count += len(self._new_lines)
+
+        self._new_lines = []
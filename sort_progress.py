@@ -0,0 +1,141 @@
+import json, threading, time
+from contextlib import contextmanager
+
+# where a sort run writes its report, and how often (seconds) the progress line is updated
+REPORT_FILE = "sort_report.json"
+PROGRESS_INTERVAL = 0.5
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}"
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+# Counters and stage timings of one sort run. Copies to other disks finish in their own threads,
+# so every update takes the lock. With show=True a progress line is printed at most every interval seconds.
+class SortProgress:
+    def __init__(self, show: bool = True, interval: float = PROGRESS_INTERVAL) -> None:
+        self.show = show
+        self.interval = interval
+        self.started = time.monotonic()
+        self.finished = None
+        self.files_scanned = 0
+        self.files_total = 0
+        self.bytes_total = 0
+        self.files_moved = 0
+        self.bytes_moved = 0
+        self.archives_unpacked = 0
+        self.folders_removed = 0
+        self.skipped = []
+        self.errors = []
+        # stage -> seconds spent in it, a stage may be entered many times
+        self.stages = {}
+        self._printed = 0.0
+        self._moves_started = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + time.monotonic() - started
+
+    def scanned(self, count: int) -> None:
+        self.files_scanned = count
+        self._maybe_print()
+
+    def planned(self, files: int, size: int) -> None:
+        self.files_total = files
+        self.bytes_total = size
+        self._moves_started = time.monotonic()
+
+    def moved(self, size: int) -> None:
+        with self._lock:
+            self.files_moved += 1
+            self.bytes_moved += size
+        self._maybe_print()
+
+    def unpacked(self, size: int) -> None:
+        with self._lock:
+            self.archives_unpacked += 1
+            self.files_moved += 1
+            self.bytes_moved += size
+        self._maybe_print()
+
+    def removed_folder(self) -> None:
+        self.folders_removed += 1
+
+    # the plan is older than the folder, somebody already took care of this file
+    def skip(self, source) -> None:
+        self.skipped.append(str(source))
+        if self.show:
+            print(f"\rSkipped, no longer exists: {source}")
+
+    def error(self, source, error: Exception) -> None:
+        with self._lock:
+            self.errors.append({"path": str(source), "error": str(error)})
+        if self.show:
+            print(f"\rCould not sort {source}: {error}")
+
+    # seconds left at the speed the files have been moved so far, None while nothing is moved
+    def eta(self) -> float:
+        if not self.files_moved or self._moves_started is None:
+            return None
+        rate = self.files_moved / max(time.monotonic() - self._moves_started, 1e-9)
+        return max(self.files_total - self.files_moved, 0) / rate
+
+    def line(self) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        eta = self.eta()
+        return (f"scanned {self.files_scanned} ({self.files_scanned / elapsed:.0f}/s) | "
+                f"moved {self.files_moved}/{self.files_total} ({self.files_moved / elapsed:.0f}/s), "
+                f"{format_size(self.bytes_moved)} ({format_size(self.bytes_moved / elapsed)}/s) | "
+                f"unpacked {self.archives_unpacked} | errors {len(self.errors)} | "
+                f"ETA {format_duration(eta) if eta is not None else '?'}")
+
+    def _maybe_print(self) -> None:
+        if not self.show:
+            return
+        now = time.monotonic()
+        if now - self._printed >= self.interval:
+            self._printed = now
+            print("\r" + self.line(), end="", flush=True)
+
+    def finish(self) -> None:
+        self.finished = time.monotonic()
+        if self.show:
+            print("\r" + self.line())
+
+    def to_dict(self) -> dict:
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return {
+            "seconds": round(elapsed, 3),
+            "files_scanned": self.files_scanned,
+            "files_planned": self.files_total,
+            "bytes_planned": self.bytes_total,
+            "files_moved": self.files_moved,
+            "bytes_moved": self.bytes_moved,
+            "archives_unpacked": self.archives_unpacked,
+            "folders_removed": self.folders_removed,
+            "skipped": self.skipped,
+            "files_per_second": round(self.files_moved / elapsed, 1) if elapsed else None,
+            "bytes_per_second": round(self.bytes_moved / elapsed) if elapsed else None,
+            "stages": {name: round(seconds, 3) for name, seconds in self.stages.items()},
+            "errors": self.errors,
+        }
+
+    def save(self, filename: str = REPORT_FILE) -> None:
+        with open(filename, "w") as writer:
+            json.dump(self.to_dict(), writer, indent=4, ensure_ascii=False)